@@ -0,0 +1,57 @@
+from psycopg2 import sql
+from exceptions import LookupError
+
+
+class Aggregate:
+    """SQL aggregate function over model field"""
+    function = None
+
+    def __init__(self, field, distinct=False):
+        self.field = field
+        self.distinct = distinct
+
+    def check_field(self, model_cls):
+        if self.field not in ['id', *model_cls._fields.keys()]:
+            raise LookupError("Cannot resolve keyword '{}' into field. Choices are: {}".
+                              format(self.field, ', '.join(['id', *model_cls._fields.keys()])))
+
+    def format(self):
+        column = sql.SQL('*') if self.field == '*' else sql.Identifier(self.field)
+        return sql.SQL("{}({}{})").format(sql.SQL(self.function),
+                                          sql.SQL('DISTINCT ' if self.distinct else ''),
+                                          column)
+
+    def shape(self):
+        return self.function, self.field, self.distinct
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.field)
+
+
+class Sum(Aggregate):
+    function = 'sum'
+
+
+class Avg(Aggregate):
+    function = 'avg'
+
+
+class Min(Aggregate):
+    function = 'min'
+
+
+class Max(Aggregate):
+    function = 'max'
+
+
+class Count(Aggregate):
+    function = 'count'
+
+    def __init__(self, field='*', distinct=False):
+        if field == '*' and distinct:
+            raise ValueError("distinct count needs a field")
+        super().__init__(field, distinct)
+
+    def check_field(self, model_cls):
+        if self.field != '*':
+            super().check_field(model_cls)
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+import psycopg2
+from psycopg2 import extensions
+from exceptions import PoolError
+from hooks import active_hooks, notify
+from pool import Connection, _pools, detach_inherited
+
+
+async def wait(conn):
+    """Wait until asynchronous connection finishes current operation, using event loop readers"""
+    loop = asyncio.get_event_loop()
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+
+        fd = conn.fileno()
+        future = loop.create_future()
+
+        def done(future=future):
+            # callback can fire again before waiting task is resumed
+            if not future.done():
+                future.set_result(None)
+
+        if state == extensions.POLL_READ:
+            loop.add_reader(fd, done)
+            remove = loop.remove_reader
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fd, done)
+            remove = loop.remove_writer
+        else:
+            raise psycopg2.OperationalError("bad poll state {}".format(state))
+
+        try:
+            await future
+        finally:
+            remove(fd)
+
+
+async def execute(conn, query, params=None, model=None):
+    """Execute query on asynchronous connection and return cursor with results"""
+    cursor = conn.cursor()
+    hooks = active_hooks(conn)
+    start = time.perf_counter()
+    cursor.execute(query, params)
+    await wait(conn)
+    if hooks is not None:
+        notify(hooks, cursor, query, params, model, time.perf_counter() - start)
+    return cursor
+
+
+class AsyncConnectionPool:
+    """Pool of asynchronous psycopg2 connections for one event loop
+
+    Connections are opened on demand, each of them runs one query at a time
+    and works in autocommit mode."""
+
+    def __init__(self, maxconn=10, timeout=30, **connect_kwargs):
+        if maxconn < 1:
+            raise ValueError("maxconn must be positive")
+
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.connect_kwargs = connect_kwargs
+        self.connect_kwargs.setdefault('connection_factory', Connection)
+
+        self._idle = []
+        self._waiters = deque()
+        self._size = 0
+        self._created = {}
+        self._configured = time.monotonic()
+        self._inherited = []
+        self.closed = False
+        _pools.add(self)
+
+    def configure(self, maxconn=None, timeout=None, **connect_kwargs):
+        """Change pool settings and connection parameters
+
+        Idle connections are closed, ones in use are closed when they are given back."""
+        self.maxconn = self.maxconn if maxconn is None else maxconn
+        self.timeout = self.timeout if timeout is None else timeout
+        self.connect_kwargs.update(connect_kwargs)
+        self._configured = time.monotonic()
+        while self._idle:
+            self._discard(self._idle.pop())
+        self._wake()
+
+    def after_fork(self):
+        """Forget connections inherited from parent process, their shared sockets are detached"""
+        detach_inherited(self._idle)
+        self._inherited.extend(self._idle)
+        self._idle = []
+        self._waiters = deque()
+        self._size = 0
+        self._created = {}
+
+    def _discard(self, conn):
+        self._size -= 1
+        self._created.pop(id(conn), None)
+        conn.close()
+
+    def _stale(self, conn):
+        """Connection opened before the last configure()"""
+        return self._created.get(id(conn), 0) < self._configured
+
+    async def _connect(self):
+        conn = psycopg2.connect(async_=True, **self.connect_kwargs)
+        try:
+            await wait(conn)
+        except BaseException:
+            conn.close()
+            raise
+        self._created[id(conn)] = time.monotonic()
+        return conn
+
+    async def acquire(self):
+        loop = asyncio.get_event_loop()
+        deadline = None if self.timeout is None else loop.time() + self.timeout
+        while True:
+            if self.closed:
+                raise PoolError("connection pool is closed")
+
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    return conn
+                self._discard(conn)
+
+            if self._size < self.maxconn:
+                self._size += 1
+                try:
+                    return await self._connect()
+                except BaseException:
+                    self._size -= 1
+                    self._wake()
+                    raise
+
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                raise PoolError("couldn't get connection in {} seconds, pool is exhausted ({} connections)".
+                                format(self.timeout, self.maxconn))
+            future = loop.create_future()
+            self._waiters.append(future)
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+
+    def release(self, conn):
+        if id(conn) not in self._created:
+            # checked out before fork, parent process gives it back
+            detach_inherited([conn])
+            self._inherited.append(conn)
+            return
+        if conn.closed or self.closed or self._stale(conn):
+            self._discard(conn)
+        else:
+            self._idle.append(conn)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # connection cancelled in the middle of query can't be reused
+            if conn.isexecuting():
+                conn.close()
+            raise
+        finally:
+            self.release(conn)
+
+    def closeall(self):
+        self.closed = True
+        while self._idle:
+            self._discard(self._idle.pop())
+        self._wake()
+
+    @property
+    def size(self):
+        return self._size
@@ -0,0 +1,223 @@
+"""Benchmark of the ORM hot paths against a throwaway PostgreSQL cluster
+
+    python benchmark.py --rows 10000 --iterations 1000 --save
+
+Cluster is created with initdb in a temp dir, started with pg_ctl on a unix
+socket and removed after the run. Results are compared with the baseline file
+when it exists, --save overwrites the baseline with the current run."""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import psycopg2
+
+
+def pg_bindir(path=None):
+    if path:
+        return path
+    if shutil.which('initdb'):
+        return os.path.dirname(shutil.which('initdb'))
+    try:
+        return subprocess.check_output(['pg_config', '--bindir']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        sys.exit("initdb not found, pass --pg-bin")
+
+
+class Cluster:
+    """Temporary PostgreSQL cluster listening only on unix socket"""
+
+    def __init__(self, bindir, port=54329):
+        self.bindir = bindir
+        self.port = port
+        self.root = tempfile.mkdtemp(prefix='orm_bench_')
+        self.data = os.path.join(self.root, 'data')
+
+    def _run(self, name, *args):
+        subprocess.run([os.path.join(self.bindir, name), *args], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def start(self):
+        self._run('initdb', '-D', self.data, '-U', 'postgres', '--auth=trust', '-E', 'UTF8')
+        self._run('pg_ctl', '-D', self.data, '-w', '-l', os.path.join(self.root, 'log'),
+                  '-o', "-p {} -k {} -c listen_addresses='' -c fsync=off".format(self.port, self.root), 'start')
+
+        conn = psycopg2.connect(host=self.root, port=self.port, user='postgres', database='postgres')
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('CREATE DATABASE orm_bench')
+        conn.close()
+
+    def stop(self):
+        try:
+            if os.path.exists(os.path.join(self.data, 'postmaster.pid')):
+                self._run('pg_ctl', '-D', self.data, '-w', '-m', 'fast', 'stop')
+        finally:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+def configure(cluster):
+    """Point model connection pools to the cluster"""
+    from model import configure
+
+    configure(host=cluster.root, port=str(cluster.port), user='postgres', password='', database='orm_bench')
+
+
+def create_tables(pool, models):
+    with pool.cursor() as cursor:
+        for model_cls in models:
+            columns = ['{} {}'.format(name, field.db_type) for name, field in model_cls._fields.items()]
+            cursor.execute('CREATE TABLE "{}" (id serial PRIMARY KEY, {})'.format(
+                str(model_cls._table_name).lower(), ', '.join(columns)))
+        cursor.connection.commit()
+
+
+def random_fields(rnd, model_cls):
+    res = {'name': ''.join(rnd.choice('abcdefghij') for _ in range(8)),
+           'description': 'benchmark row',
+           'date_added': datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=rnd.randint(0, 10 ** 6)),
+           'age': rnd.randint(0, 100),
+           'coins': round(rnd.uniform(0, 1000), 2),
+           'is_superuser': rnd.random() < 0.1}
+    if 'sex' in model_cls._fields:
+        res['sex'] = rnd.choice('mf')
+    return res
+
+
+def seed(rnd, models, rows):
+    for model_cls in models:
+        model_cls.objects.bulk_create([model_cls(**random_fields(rnd, model_cls)) for _ in range(rows)])
+
+
+def operations(rnd, rows):
+    from model import Condition, pool
+    from my_models import User, Man
+
+    ids = list(range(1, rows + 1))
+
+    def get():
+        User.objects.get(id=rnd.choice(ids))
+
+    def build():
+        list(Man.objects.filter(age__ge=rnd.randint(0, 100))[:100])
+
+    def format_cond():
+        with pool.connection() as conn:
+            for cond in (('name__startswith', 'ab'), ('age__in', [1, 2, 3]), ('coins__gt', 10)):
+                Condition(cond, User).format_cond().as_string(conn)
+
+    def save():
+        user = User.objects.get(id=rnd.choice(ids))
+        user.coins = round(rnd.uniform(0, 1000), 2)
+        user.save()
+
+    def create():
+        User.objects.create(**random_fields(rnd, User))
+
+    def count():
+        User.objects.filter(age__lt=rnd.randint(0, 100)).count()
+
+    return {'get': get, 'build': build, 'format_cond': format_cond, 'save': save, 'create': create,
+            'count': count}
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(func, iterations, memory_iterations):
+    for _ in range(min(iterations, 50)):
+        func()
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    latencies.sort()
+
+    # tracemalloc slows down allocations, so memory is measured in a separate pass
+    tracemalloc.start()
+    for _ in range(memory_iterations):
+        func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'ops': iterations / total,
+            'p50': percentile(latencies, 50) * 1000,
+            'p95': percentile(latencies, 95) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'peak_kib': peak / 1024}
+
+
+def report(results, baseline):
+    header = '{:<12} {:>10} {:>9} {:>9} {:>9} {:>10}'.format('operation', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms',
+                                                             'peak KiB')
+    if baseline:
+        header += ' {:>9} {:>9}'.format('ops diff', 'p50 diff')
+    print(header)
+    for name, res in results.items():
+        line = '{:<12} {ops:>10.1f} {p50:>9.3f} {p95:>9.3f} {p99:>9.3f} {peak_kib:>10.1f}'.format(name, **res)
+        base = (baseline or {}).get(name)
+        if base:
+            line += ' {:>+8.1f}% {:>+8.1f}%'.format((res['ops'] / base['ops'] - 1) * 100,
+                                                    (res['p50'] / base['p50'] - 1) * 100)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help='rows seeded into every table')
+    parser.add_argument('--iterations', type=int, default=1000, help='timed calls of every operation')
+    parser.add_argument('--memory-iterations', type=int, default=100, help='calls traced for peak memory')
+    parser.add_argument('--only', nargs='+', help='run only given operations')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save', action='store_true', help='save results as the new baseline')
+    parser.add_argument('--pg-bin', help='directory with initdb and pg_ctl')
+    args = parser.parse_args()
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    cluster = Cluster(pg_bindir(args.pg_bin))
+    cluster.start()
+    try:
+        configure(cluster)
+        from model import pool
+        from my_models import User, Man
+
+        rnd = random.Random(args.seed)
+        create_tables(pool, [User, Man])
+        seed(rnd, [User, Man], args.rows)
+
+        results = {}
+        for name, func in operations(rnd, args.rows).items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = measure(func, args.iterations, args.memory_iterations)
+        pool.closeall()
+    finally:
+        cluster.stop()
+
+    report(results, baseline)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('baseline saved to', args.baseline)
+
+
+if __name__ == '__main__':
+    main()
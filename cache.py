@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+
+_result_cache = None
+
+
+class BaseCache:
+    """Interface of query result cache backends
+
+    Keys are strings made from compiled SQL and its params, every entry
+    is tagged with tables it was read from."""
+
+    def get(self, key):
+        """Return cached value or None"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None, tables=()):
+        raise NotImplementedError
+
+    def invalidate(self, table):
+        """Drop all entries read from table"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(BaseCache):
+    """In-process cache with TTL and limited number of entries"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, key):
+        expires, tables, value = self._entries.pop(key)
+        for table in tables:
+            keys = self._tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tables[table]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, value, ttl=None, tables=()):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, tuple(tables), value)
+            for table in tables:
+                self._tables.setdefault(table, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, table):
+        with self._lock:
+            for key in list(self._tables.get(table, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tables.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def set_result_cache(backend):
+    """Set backend used by cached querysets, None disables caching"""
+    global _result_cache
+    if backend is not None and not isinstance(backend, BaseCache):
+        raise TypeError("result cache backend must be BaseCache instance")
+    _result_cache = backend
+
+
+def get_result_cache():
+    return _result_cache
+
+
+def cache_key(query, params):
+    return '{}\x00{!r}'.format(query, list(params))
+
+
+def invalidate_table(table):
+    if _result_cache is not None:
+        _result_cache.invalidate(table)
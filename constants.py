@@ -5,3 +5,14 @@ password_db_constant = "qwe123@#29"
 host_db_constant = "127.0.0.1"
 port_db_constant = "5432"
 database_db_constant = "ormdb"
+
+""" FOR CONNECTION POOL """
+
+pool_min_constant = 1
+pool_max_constant = 10
+pool_timeout_constant = 30
+pool_max_age_constant = 3600
+
+""" FOR PREPARED STATEMENTS """
+
+prepared_max_constant = 100
@@ -0,0 +1,95 @@
+import keyword
+from fields import Field
+
+_member_descriptor = type(type('_Slotted', (), {'__slots__': ('x',)}).__dict__['x'])
+_reserved = {'self', 'obj', 'd', '_', '__'}
+
+
+def _setter(cls, name):
+    """Slot descriptor's __set__ for slot attribute, None for attribute stored in __dict__"""
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            desc = klass.__dict__[name]
+            return desc.__set__ if isinstance(desc, _member_descriptor) else None
+    return None
+
+
+def _assign(cls, name, value, namespace):
+    """Source line storing value to attribute without going through Model.__setattr__"""
+    setter = _setter(cls, name)
+    if setter is None:
+        return "    d[{!r}] = {}".format(name, value)
+    setter_name = '_set{}'.format(len(namespace))
+    namespace[setter_name] = setter
+    return "    {}(obj, {})".format(setter_name, value)
+
+
+def _state(cls, loaded, namespace):
+    """Lines setting tracking slots, unset slot would make every read of them go through __getattr__"""
+    namespace['_nothing_deferred'] = frozenset()
+    values = {'_loaded': str(loaded), '_changed': 'None', '_deferred': '_nothing_deferred', '_related': 'None'}
+    return [_assign(cls, name, value, namespace) for name, value in values.items()
+            if name == '_loaded' or _setter(cls, name) is not None]
+
+
+def _compile(name, header, body, namespace):
+    if any(i.startswith("    d[") for i in body):
+        header.append("    d = obj.__dict__")
+    exec('\n'.join([*header, *body]), namespace)
+    return namespace[name]
+
+
+def make_decoder(cls, names):
+    """Generate function building loaded object of cls from row with columns names
+
+    Values came from database, so they are assigned without validation. Fields
+    missing from row are set to None, unknown columns are skipped."""
+    namespace = {'_new': object.__new__, '_cls': cls}
+    lines = []
+
+    attributes = ['id', *cls._fields]
+    targets = ['v{}'.format(n) if name in attributes else '_' for n, name in enumerate(names)]
+    if targets:
+        lines.append("    {}, = row".format(', '.join(targets)))
+    for n, name in enumerate(names):
+        if name in attributes:
+            lines.append(_assign(cls, name, 'v{}'.format(n), namespace))
+    for name in attributes:
+        if name not in names:
+            lines.append(_assign(cls, name, 'None', namespace))
+    lines.extend(_state(cls, True, namespace))
+    lines.append("    return obj")
+    return _compile('decode', ["def decode(row):", "    obj = _new(_cls)"], lines, namespace)
+
+
+def make_init(cls, generic_init):
+    """Generate __init__ of cls validating every field without generic loop over _fields
+
+    Subclasses calling it through super() have fields it doesn't know, they get
+    generic_init instead. Returns None if field names can't be used as keyword arguments."""
+    attributes = ['id', *cls._fields, *cls._relations]
+    if any(keyword.iskeyword(i) or i in _reserved for i in attributes):
+        return None
+
+    namespace = {'_cls': cls, '_generic_init': generic_init}
+    lines = [*_state(cls, False, namespace), _assign(cls, 'id', 'id', namespace)]
+    for n, (name, field) in enumerate(cls._fields.items()):
+        if type(field).validate is Field.validate:
+            # inlined Field.validate
+            namespace['_type{}'.format(n)] = field.f_type
+            value = '_type{0}({1})' if field.required else '{1} if {1} is None else _type{0}({1})'
+        else:
+            namespace['_validate{}'.format(n)] = field.validate
+            value = '_validate{0}({1})'
+        lines.append(_assign(cls, name, value.format(n, name), namespace))
+    for name in cls._relations:
+        # relation descriptor sets id field from related object
+        lines.append("    if {0} is not None:\n        obj.{0} = {0}".format(name))
+
+    header = ["def __init__(self, *_, {}, **__):".format(', '.join('{}=None'.format(i) for i in attributes)),
+              "    if type(self) is not _cls:",
+              "        return _generic_init(self, {}, **__)".format(', '.join('{0}={0}'.format(i) for i in attributes)),
+              "    obj = self"]
+    init = _compile('__init__', header, lines, namespace)
+    init._generated = True
+    return init
@@ -28,3 +28,7 @@ class ParentClashError(Exception):
 
 class LookupError(Exception):
     pass
+
+
+class PoolError(Exception):
+    pass
@@ -3,11 +3,21 @@ from exceptions import IntegrityError
 
 
 class Field:
+    db_type = None
+
     def __init__(self, f_type, required=False, default=None):
         self.f_type = f_type
         self.required = required
         self.default = default
 
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is not None and self.name in getattr(instance, '_deferred', ()):
+            return instance.load_deferred(self.name)
+        return self
+
     def validate(self, value):
         if value is None and not self.required:
             return None
@@ -15,16 +25,22 @@ class Field:
 
 
 class IntField(Field):
+    db_type = 'integer'
+
     def __init__(self, required=False, default=None):
         super().__init__(int, required, default)
 
 
 class StringField(Field):
+    db_type = 'text'
+
     def __init__(self, required=False, default=None):
         super().__init__(str, required, default)
 
 
 class DateField(Field):
+    db_type = 'timestamp'
+
     def __init__(self, required=False, default=None):
         super().__init__(datetime.datetime, required, default)
 
@@ -42,10 +58,67 @@ class DateField(Field):
 
 
 class FloatField(Field):
+    db_type = 'double precision'
+
     def __init__(self, required=False, default=None):
         super().__init__(float, required, default)
 
 
 class BooleanField(Field):
+    db_type = 'boolean'
+
     def __init__(self, required=False, default=None):
         super().__init__(bool, required, default)
+
+
+class ForeignKeyField(Field):
+    """Reference to object of model to ('self' for own model), its id is stored in <name>_id column
+
+    Related object is loaded on first access and kept on instance."""
+    db_type = 'integer'
+
+    def __init__(self, to, required=False, default=None):
+        super().__init__(int, required, default)
+        self.to = to
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.column = '{}_id'.format(name)
+
+    def column_field(self):
+        """Plain field of the id column"""
+        return IntField(required=self.required, default=self.default)
+
+    def cached(self, instance):
+        """Related object kept on instance if it still matches id column, else None"""
+        obj = (getattr(instance, '_related', None) or {}).get(self.name)
+        if obj is not None and obj.id == getattr(instance, self.column):
+            return obj
+        return None
+
+    def cache(self, instance, obj):
+        related = getattr(instance, '_related', None)
+        if related is None:
+            related = {}
+            object.__setattr__(instance, '_related', related)
+        related[self.name] = obj
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        related_id = getattr(instance, self.column)
+        if related_id is None:
+            return None
+        obj = self.cached(instance)
+        if obj is None:
+            obj = self.to.objects.get(id=related_id)
+            self.cache(instance, obj)
+        return obj
+
+    def __set__(self, instance, value):
+        if value is not None and not isinstance(value, self.to):
+            raise IntegrityError("{} must be {} object".format(self.name, self.to.__name__))
+        if value is not None and value.id is None:
+            raise IntegrityError("related {} object must be saved before assignment".format(self.to.__name__))
+        setattr(instance, self.column, None if value is None else value.id)
+        self.cache(instance, value)
@@ -0,0 +1,139 @@
+import bisect
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger('orm.queries')
+
+QueryEvent = namedtuple('QueryEvent', ['sql', 'params', 'duration', 'rowcount', 'model', 'connection'])
+
+_hooks = []
+
+
+def add_hook(hook, connection=None):
+    """Call hook with QueryEvent after every query, on given connection only or on all of them"""
+    hooks = _hooks if connection is None else connection.hooks
+    if hook not in hooks:
+        hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook, connection=None):
+    hooks = _hooks if connection is None else connection.hooks
+    if hook in hooks:
+        hooks.remove(hook)
+
+
+def active_hooks(connection):
+    """Hooks that observe queries on connection or None"""
+    conn_hooks = getattr(connection, 'hooks', None)
+    if not _hooks and not conn_hooks:
+        return None
+    return [*_hooks, *(conn_hooks or ())]
+
+
+def notify(hooks, cursor, query, params, model, duration):
+    if isinstance(query, bytes):
+        query = query.decode()
+    event = QueryEvent(query, params, duration, cursor.rowcount, model, cursor.connection)
+    for hook in hooks:
+        hook(event)
+
+
+def run(cursor, query, params, model, func, *args, **kwargs):
+    """Call func that executes query on cursor and report it to hooks
+
+    Without registered hooks it's a plain call, nothing is timed or built."""
+    hooks = active_hooks(cursor.connection)
+    if hooks is None:
+        return func(*args, **kwargs)
+
+    start = time.perf_counter()
+    res = func(*args, **kwargs)
+    notify(hooks, cursor, query, params, model, time.perf_counter() - start)
+    return res
+
+
+def execute(cursor, query, params=None, model=None):
+    return run(cursor, query, params, model, cursor.execute, query, params)
+
+
+class SlowQueryLog:
+    """Log queries that run longer than threshold seconds"""
+
+    def __init__(self, threshold=0.5, log=None, level=logging.WARNING):
+        self.threshold = threshold
+        self.log = log or logger
+        self.level = level
+
+    def __call__(self, event):
+        if event.duration >= self.threshold:
+            self.log.log(self.level, "slow query %.3fs (%s rows, %s): %s %r", event.duration, event.rowcount,
+                         event.model.__name__ if event.model is not None else '-', event.sql, event.params)
+
+
+class LatencyHistogram:
+    """Latency histogram per query shape, shape is SQL with placeholders"""
+
+    def __init__(self, buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)):
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        self._shapes = {}
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self._shapes.get(event.sql)
+            if stats is None:
+                stats = self._shapes[event.sql] = {'count': 0, 'total': 0.0, 'max': 0.0,
+                                                   'buckets': [0] * (len(self.buckets) + 1)}
+            stats['count'] += 1
+            stats['total'] += event.duration
+            stats['max'] = max(stats['max'], event.duration)
+            stats['buckets'][bisect.bisect_left(self.buckets, event.duration)] += 1
+
+    def percentile(self, query, p):
+        """Upper bound of bucket holding p-th percentile latency of query shape, None for unseen shape"""
+        with self._lock:
+            stats = self._shapes.get(query)
+            if stats is None:
+                return None
+            rank = stats['count'] * p / 100
+            seen = 0
+            for bound, n in zip([*self.buckets, stats['max']], stats['buckets']):
+                seen += n
+                if seen >= rank:
+                    return bound
+            return stats['max']
+
+    def snapshot(self):
+        """Copy of collected stats by query shape"""
+        with self._lock:
+            return {query: {**stats, 'buckets': list(stats['buckets'])} for query, stats in self._shapes.items()}
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+
+
+class ExplainCapture:
+    """Keep EXPLAIN ANALYZE plans of SELECT queries slower than threshold
+
+    Plan is collected by running the query once more on the same connection."""
+
+    def __init__(self, threshold=1.0, maxlen=100, analyze=True):
+        self.threshold = threshold
+        self.analyze = analyze
+        self.plans = deque(maxlen=maxlen)
+
+    def __call__(self, event):
+        if event.duration < self.threshold or not event.sql.lstrip().upper().startswith('SELECT'):
+            return
+        if getattr(event.connection, 'async_', False):
+            # async connection can't run blocking query from hook
+            return
+        with event.connection.cursor() as cursor:
+            cursor.execute('EXPLAIN {}{}'.format('ANALYZE ' if self.analyze else '', event.sql), event.params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.plans.append((event.sql, event.params, event.duration, plan))
+        logger.info("plan of %.3fs query %s:\n%s", event.duration, event.sql, plan)
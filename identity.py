@@ -0,0 +1,69 @@
+import contextvars
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_current_map = contextvars.ContextVar('identity_map', default=None)
+
+
+class IdentityMap:
+    """Keeps one object per (model, id), least recently used objects are evicted"""
+
+    def __init__(self, maxsize=1000):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self._objects = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model_cls, obj_id):
+        with self._lock:
+            obj = self._objects.get((model_cls, obj_id))
+            if obj is not None:
+                self._objects.move_to_end((model_cls, obj_id))
+            return obj
+
+    def add(self, obj, replace=False):
+        """Remember object and return the instance that represents its row"""
+        key = (type(obj), obj.id)
+        with self._lock:
+            existing = self._objects.get(key)
+            if existing is not None and not replace:
+                self._objects.move_to_end(key)
+                return existing
+
+            self._objects[key] = obj
+            self._objects.move_to_end(key)
+            while len(self._objects) > self.maxsize:
+                self._objects.popitem(last=False)
+        return obj
+
+    def discard(self, model_cls, obj_id):
+        with self._lock:
+            self._objects.pop((model_cls, obj_id), None)
+
+    def discard_model(self, model_cls):
+        with self._lock:
+            for key in [i for i in self._objects if i[0] is model_cls]:
+                del self._objects[key]
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+    def __len__(self):
+        return len(self._objects)
+
+
+def current_identity_map():
+    return _current_map.get()
+
+
+@contextmanager
+def identity_map(maxsize=1000):
+    """Share objects loaded by id inside the block, works per thread and per asyncio task"""
+    token = _current_map.set(IdentityMap(maxsize))
+    try:
+        yield _current_map.get()
+    finally:
+        _current_map.reset(token)
@@ -1,7 +1,7 @@
 from my_models import User, Man
 import datetime
 import random
-from model import cursor
+from model import pool
 from psycopg2 import sql
 
 # from itertools import combinations
@@ -1,7 +1,20 @@
-import psycopg2
+import base64
+import contextlib
+import datetime
+import itertools
+import json
+import operator
+import os
+import re
+import threading
+from collections import OrderedDict
 from psycopg2 import sql
+from psycopg2 import extensions
 from psycopg2 import _ext
-from fields import Field
+from psycopg2.extras import execute_values
+from fields import Field, ForeignKeyField
+from aggregates import Aggregate
+from decoders import make_decoder, make_init
 from exceptions import (MultipleObjectsReturned,
                         DoesNotExist,
                         DeleteError,
@@ -10,18 +23,172 @@ from exceptions import (MultipleObjectsReturned,
                         IntegrityError,
                         ParentClashError,
                         LookupError)
+from pool import ConnectionPool
+from identity import current_identity_map
+from cache import get_result_cache, cache_key, invalidate_table
+from transaction import atomic, commit, in_atomic
+from session import current_unit_of_work
+from hooks import run, execute
+from aio import AsyncConnectionPool, execute as async_execute
+from router import Router
 from constants import (user_db_constant,
                        password_db_constant,
                        host_db_constant,
                        port_db_constant,
-                       database_db_constant)
+                       database_db_constant,
+                       pool_min_constant,
+                       pool_max_constant,
+                       pool_timeout_constant,
+                       pool_max_age_constant,
+                       prepared_max_constant)
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get(name)
+    return default if value is None else cast(value)
+
+
+# ORM_* environment variables override constants, nothing connects until the first query
+connection_settings = {'user': _env('ORM_DB_USER', user_db_constant),
+                       'password': _env('ORM_DB_PASSWORD', password_db_constant),
+                       'host': _env('ORM_DB_HOST', host_db_constant),
+                       'port': _env('ORM_DB_PORT', port_db_constant),
+                       'database': _env('ORM_DB_NAME', database_db_constant)}
+
+pool = ConnectionPool(minconn=_env('ORM_POOL_MIN', pool_min_constant, int),
+                      maxconn=_env('ORM_POOL_MAX', pool_max_constant, int),
+                      timeout=_env('ORM_POOL_TIMEOUT', pool_timeout_constant, float),
+                      max_age=_env('ORM_POOL_MAX_AGE', pool_max_age_constant, float),
+                      lazy=True,
+                      **connection_settings)
+async_pool = AsyncConnectionPool(maxconn=_env('ORM_POOL_MAX', pool_max_constant, int),
+                                 timeout=_env('ORM_POOL_TIMEOUT', pool_timeout_constant, float),
+                                 **connection_settings)
 
-connection = psycopg2.connect(user=user_db_constant,
-                              password=password_db_constant,
-                              host=host_db_constant,
-                              port=port_db_constant,
-                              database=database_db_constant)
-cursor = connection.cursor()
+
+def _replica_pool(replica):
+    """Lazy pool of replica, replica is 'host[:port]' or dict of psycopg2.connect arguments"""
+    if isinstance(replica, str):
+        host, _, port = replica.partition(':')
+        replica = {'host': host, 'port': port or connection_settings['port']}
+    # query routed to replica by mistake fails instead of writing there
+    return ConnectionPool(pool.minconn, pool.maxconn, pool.timeout, pool.max_age, lazy=True,
+                          **{'options': '-c default_transaction_read_only=on', **connection_settings, **replica})
+
+
+# kept to rebuild replica pools when primary settings change
+_replica_specs = [i for i in _env('ORM_DB_REPLICAS', '').split(',') if i]
+router = Router(pool,
+                [_replica_pool(i) for i in _replica_specs],
+                strategy=_env('ORM_DB_ROUTING', 'round_robin'),
+                read_your_writes=_env('ORM_READ_YOUR_WRITES', 1.0, float))
+
+
+def configure_replicas(*replicas, strategy='round_robin', read_your_writes=1.0):
+    """Route reads to replicas, each is 'host[:port]' or dict of psycopg2.connect arguments
+
+    Other connection settings are taken from primary, reads go to primary for
+    read_your_writes seconds after a write of the same thread or task."""
+    old = list(router.replicas.values())
+    _replica_specs[:] = replicas
+    router.configure([_replica_pool(i) for i in replicas], strategy, read_your_writes)
+    for replica in old:
+        replica.closeall()
+
+
+def _after_write(table, conn=None):
+    """Invalidate cached results of table, inside atomic block it's done after the outermost commit"""
+    if conn is not None and in_atomic(conn):
+        conn.touched.add(table)
+    else:
+        invalidate_table(table)
+    router.record_write()
+
+
+def _write_block():
+    """Transaction of write sending several statements, inside atomic block it joins the block"""
+    current = pool.current()
+    if current is not None and in_atomic(current):
+        return contextlib.nullcontext()
+    return atomic()
+
+
+def configure(minconn=None, maxconn=None, timeout=None, max_age=None, **connect_kwargs):
+    """Change pool sizes and psycopg2.connect arguments of primary, async and replica pools
+
+    Connections opened with previous settings are closed, new ones are opened on demand.
+    Replicas keep their own host and port."""
+    connection_settings.update(connect_kwargs)
+    pool.configure(minconn, maxconn, timeout, max_age, **connect_kwargs)
+    async_pool.configure(maxconn, timeout, **connect_kwargs)
+    if _replica_specs:
+        configure_replicas(*_replica_specs, strategy=router.strategy, read_your_writes=router.read_your_writes)
+
+
+_cursor_counter = itertools.count()
+
+
+class QueryCache:
+    """LRU cache of compiled SQL strings keyed by query shape"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, key, compose, context):
+        """Return SQL string for key, compose() is called only on cache miss"""
+        with self._lock:
+            query = self._queries.get(key)
+            if query is not None:
+                self._queries.move_to_end(key)
+                return query
+
+        query = compose().as_string(context)
+        with self._lock:
+            self._queries[key] = query
+            while len(self._queries) > self.maxsize:
+                self._queries.popitem(last=False)
+        return query
+
+    def clear(self):
+        with self._lock:
+            self._queries.clear()
+
+
+query_cache = QueryCache()
+_not_loaded = object()
+_statement_counter = itertools.count()
+_placeholder_re = re.compile(r'%[s%]')
+
+
+def execute_prepared(cursor, key, query, params, model=None):
+    """Execute query as server-side prepared statement
+
+    Statements are prepared once per connection and query shape, the least
+    recently used ones are deallocated when there are more than prepared_max_constant."""
+    statements = getattr(cursor.connection, 'prepared', None)
+    if statements is None or not prepared_max_constant:
+        return execute(cursor, query, params, model)
+
+    name = statements.get(key)
+    if name is None:
+        numbers = itertools.count(1)
+        name = 'orm_stmt_{}'.format(next(_statement_counter))
+        cursor.execute('PREPARE {} AS {}'.format(name, _placeholder_re.sub(
+            lambda m: '%' if m.group() == '%%' else '${}'.format(next(numbers)), query)))
+        statements[key] = name
+
+        if len(statements) > prepared_max_constant:
+            cursor.execute('DEALLOCATE {}'.format(statements.popitem(last=False)[1]))
+    else:
+        statements.move_to_end(key)
+
+    # hooks see the original query, it can be explained unlike EXECUTE
+    if params:
+        return run(cursor, query, params, model, cursor.execute,
+                   'EXECUTE {}({})'.format(name, ', '.join(['%s'] * len(params))), params)
+    return run(cursor, query, params, model, cursor.execute, 'EXECUTE {}'.format(name))
 
 
 class ModelMeta(type):
@@ -43,12 +210,19 @@ class ModelMeta(type):
         if len(bases) > 1:
             raise ParentClashError("You can't inherit more than one table!")
 
+        # relations stay in class as descriptors, ids are stored in plain <name>_id fields
+        relations = {k: v for k, v in namespace.items() if isinstance(v, ForeignKeyField)}
+        for field_name, relation in relations.items():
+            relation.__set_name__(None, field_name)
+            namespace[relation.column] = relation.column_field()
+
         if bases[0] != Model:
             fields = {k: v for k, v in [*namespace.items(), *bases[0]._fields.items()]
-                      if isinstance(v, Field)}
+                      if isinstance(v, Field) and not isinstance(v, ForeignKeyField)}
+            relations = {**bases[0]._relations, **relations}
         else:
             fields = {k: v for k, v in namespace.items()
-                      if isinstance(v, Field)}
+                      if isinstance(v, Field) and not isinstance(v, ForeignKeyField)}
 
         if hasattr(meta, 'order_by'):
             if isinstance(meta.order_by, (tuple, list)):
@@ -60,10 +234,35 @@ class ModelMeta(type):
                 raise OrderByFieldError(
                     'ordering refers to the nonexistent field \'{}\''.format(stripped_order))
 
+        if getattr(meta, 'slots', False):
+            # fields become slots, so Field objects can't stay in class namespace
+            for field_name in [k for k, v in namespace.items()
+                               if isinstance(v, Field) and not isinstance(v, ForeignKeyField)]:
+                namespace.pop(field_name).__set_name__(None, field_name)
+            parent_slots = {i for klass in bases[0].__mro__ for i in getattr(klass, '__slots__', ())}
+            namespace['__slots__'] = tuple(i for i in ['id', '_deferred', '_deferred_loader', '_loaded', '_changed',
+                                                      '_related', *fields]
+                                           if i not in parent_slots)
+
         # print(name, fields)
         namespace['_fields'] = fields
+        namespace['_relations'] = relations
         namespace['_order_by'] = getattr(meta, 'order_by', None)
-        return super().__new__(mcs, name, bases, namespace)
+        namespace['_decoders'] = {}
+        cls = super().__new__(mcs, name, bases, namespace)
+
+        for relation in relations.values():
+            if relation.to == 'self':
+                relation.to = cls
+
+        # custom __init__ of the class or any parent is kept, generated ones of parents are replaced
+        inits = [klass.__dict__['__init__'] for klass in cls.__mro__
+                 if '__init__' in klass.__dict__ and klass not in (Model, object)]
+        if all(getattr(i, '_generated', False) for i in inits):
+            init = make_init(cls, Model.__init__)
+            if init is not None:
+                cls.__init__ = init
+        return cls
 
 
 class Condition:
@@ -75,11 +274,18 @@ class Condition:
     def quote_replace(string):
         return str(string).replace('\'', '\'\'')
 
+    @staticmethod
+    def related_value(value):
+        """Id of model object, values of other types are returned as is"""
+        return value.id if isinstance(value, Model) else value
+
     @staticmethod
     def check_fields(cond, owner_class):
         # print(cond)
         condspl = cond[0].split('__')
 
+        if condspl[0] in getattr(owner_class, '_relations', ()):
+            condspl[0] = owner_class._relations[condspl[0]].column
         if condspl[0] not in ['id', *owner_class._fields.keys()]:
             raise LookupError("Cannot resolve keyword '{}' into field. Choices are: {}".
                               format(condspl[0], ', '.join(owner_class._fields.keys())))
@@ -97,50 +303,53 @@ class Condition:
         # else:
         #     tmp_value = cond[1]
 
+        value = cond[1]
+        if cond[0].split('__')[0] in getattr(owner_class, '_relations', ()):
+            value = [Condition.related_value(i) for i in value] if len(condspl) == 2 and condspl[1] == 'in' \
+                else Condition.related_value(value)
+
         if len(condspl) == 2:
-            return str(condspl[0]), str(condspl[1]), cond[1]
+            return str(condspl[0]), str(condspl[1]), value
         elif len(condspl) == 1:
-            return str(condspl[0]), 'exact', cond[1]
+            return str(condspl[0]), 'exact', value
         else:
             raise LookupError("unresolved lookup {}".format(cond))
 
+    @staticmethod
+    def escape_like(value):
+        return str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
     def format_cond(self):
-        if self.cond in self._conditions:
-            like_value = str(self.value).replace('\'', '\'\'')
-            if self.cond == 'exact':
-                return sql.SQL("{}={}").format(sql.Identifier(self.field_name),
-                                               sql.Literal(str(self.value))).as_string(cursor)
-            elif self.cond == 'in':
-                print(self.value)
-                print(tuple(self.value))
-                # print([sql.Literal(i) for i in self.value])
-                tmp_compose = sql.Composed(sql.SQL(', ').join([sql.Literal(i) for i in tuple(self.value)]))
-                print(tmp_compose)
-                return sql.SQL("{} IN ({})").format(sql.Identifier(self.field_name),
-                                                    tmp_compose).as_string(cursor)
-            elif self.cond == 'lt':
-                return sql.SQL("{} < {}").format(sql.Identifier(self.field_name),
-                                                 sql.Literal(str(self.value))).as_string(cursor)
-            elif self.cond == 'gt':
-                return sql.SQL("{} > {}").format(sql.Identifier(self.field_name),
-                                                 sql.Literal(str(self.value))).as_string(cursor)
-            elif self.cond == 'le':
-                return sql.SQL("{} <= {}").format(sql.Identifier(self.field_name),
-                                                  sql.Literal(str(self.value))).as_string(cursor)
-            elif self.cond == 'ge':
-                return sql.SQL("{} >= {}").format(sql.Identifier(self.field_name),
-                                                  sql.Literal(str(self.value))).as_string(cursor)
-            elif self.cond == 'contains':
-                return sql.SQL("{} LIKE '%{}%' ESCAPE '\\'").format(sql.Identifier(self.field_name),
-                                                                    sql.SQL(like_value)).as_string(cursor)
-            elif self.cond == 'startswith':
-                return sql.SQL("{} LIKE '{}%' ESCAPE '\\'").format(sql.Identifier(self.field_name),
-                                                                   sql.SQL(like_value)).as_string(cursor)
-            elif self.cond == 'endswith':
-                return sql.SQL("{} LIKE '%{}' ESCAPE '\\'").format(sql.Identifier(self.field_name),
-                                                                   sql.SQL(like_value)).as_string(cursor)
-            else:
-                raise LookupError("Unsupported lookup '{}' for {} column.".format(self.cond, self.field_name))
+        if self.cond == 'exact':
+            return sql.SQL("{}=%s").format(sql.Identifier(self.field_name))
+        elif self.cond == 'in':
+            return sql.SQL("{} = ANY(%s)").format(sql.Identifier(self.field_name))
+        elif self.cond == 'lt':
+            return sql.SQL("{} < %s").format(sql.Identifier(self.field_name))
+        elif self.cond == 'gt':
+            return sql.SQL("{} > %s").format(sql.Identifier(self.field_name))
+        elif self.cond == 'le':
+            return sql.SQL("{} <= %s").format(sql.Identifier(self.field_name))
+        elif self.cond == 'ge':
+            return sql.SQL("{} >= %s").format(sql.Identifier(self.field_name))
+        elif self.cond in ('contains', 'startswith', 'endswith'):
+            return sql.SQL("{} LIKE %s ESCAPE '\\'").format(sql.Identifier(self.field_name))
+        else:
+            raise LookupError("Unsupported lookup '{}' for {} column.".format(self.cond, self.field_name))
+
+    def format_param(self):
+        if self.cond == 'in':
+            return list(self.value)
+        elif self.cond == 'contains':
+            return '%{}%'.format(self.escape_like(self.value))
+        elif self.cond == 'startswith':
+            return '{}%'.format(self.escape_like(self.value))
+        elif self.cond == 'endswith':
+            return '%{}'.format(self.escape_like(self.value))
+        elif self.cond in self._conditions:
+            return str(self.value)
+        else:
+            raise LookupError("Unsupported lookup '{}' for {} column.".format(self.cond, self.field_name))
 
 
 class QuerySet:
@@ -150,6 +359,15 @@ class QuerySet:
         self.where: dict = where
         self.res = res
         self.limit = limit
+        self.deferred = set()
+        self.seek = None
+        self.annotations = {}
+        self.grouping = []
+        self._using = None
+        self.related = []
+        self.prefetch = []
+        self.cache_ttl = None
+        self.use_cache = False
         self.__cache = {'count': -1, 'order_by': 0}
 
         if order_by is not None and isinstance(order_by, (list, tuple)):
@@ -157,6 +375,8 @@ class QuerySet:
         elif hasattr(self.model_cls, '_order_by'):
             if isinstance(self.model_cls._order_by, (list, tuple)):
                 self._order_by: list = self.model_cls._order_by
+            else:
+                self._order_by = None
         elif order_by is not None:
             raise ValueError("ordering can be only tuple or list object")
         else:
@@ -170,34 +390,64 @@ class QuerySet:
             return where_list
         return None
 
+    def where_params(self):
+        if self.where:
+            return [Condition(i, self.model_cls).format_param() for i in self.where.items()]
+        return []
+
+    def where_shape(self):
+        return tuple(self.where) if self.where else ()
+
     def format_limit(self):
         if self.limit is not None:
             limit_list = []
 
             if isinstance(self.limit, slice):
                 if self.limit.start:
-                    limit_list.extend([sql.SQL('OFFSET'), sql.SQL(str(self.limit.start))])
+                    limit_list.extend([sql.SQL('OFFSET'), sql.SQL('%s')])
                 if self.limit.stop:
-                    limit_list.extend([sql.SQL('LIMIT'), sql.SQL(str(self.limit.stop - (self.limit.start or 0)))])
+                    limit_list.extend([sql.SQL('LIMIT'), sql.SQL('%s')])
                 return limit_list
             elif isinstance(self.limit, int):
-                limit_list.extend([sql.SQL('OFFSET'), sql.SQL(str(self.limit)), sql.SQL('LIMIT'), sql.SQL('1')])
+                limit_list.extend([sql.SQL('OFFSET'), sql.SQL('%s'), sql.SQL('LIMIT'), sql.SQL('1')])
                 return limit_list
             else:
                 raise TypeError('unsupported type of limit index')
         return None
 
-    def format_order_list(self):
-        if self._order_by:
+    def limit_params(self):
+        if isinstance(self.limit, slice):
+            params = []
+            if self.limit.start:
+                params.append(self.limit.start)
+            if self.limit.stop:
+                params.append(self.limit.stop - (self.limit.start or 0))
+            return params
+        elif isinstance(self.limit, int):
+            return [self.limit]
+        return []
+
+    def limit_shape(self):
+        if isinstance(self.limit, slice):
+            return bool(self.limit.start), bool(self.limit.stop)
+        return self.limit if self.limit is None else 'index'
+
+    def order_shape(self):
+        return tuple(self._order_by) if self._order_by else ()
+
+    def format_order_list(self, order_by=None, table=None):
+        order_by = self._order_by if order_by is None else order_by
+        if order_by:
             formatted_order = []
 
-            for i in self._order_by:
+            for i in order_by:
+                column = sql.Identifier(i.strip('-'))
+                if table is not None:
+                    column = sql.SQL("{}.{}").format(sql.Identifier(table), column)
                 if i.startswith('-'):
-                    formatted_order.append(
-                        sql.SQL("{} DESC NULLS LAST").format(sql.Identifier(i.strip('-'))))
+                    formatted_order.append(sql.SQL("{} DESC NULLS LAST").format(column))
                 else:
-                    formatted_order.append(
-                        sql.SQL("{} NULLS FIRST").format(sql.Identifier(i.strip('-'))))
+                    formatted_order.append(sql.SQL("{} NULLS FIRST").format(column))
             return formatted_order
         return None
 
@@ -250,7 +500,7 @@ class QuerySet:
     def order_by(self, *args):
         if isinstance(args, (tuple, list)):
             stripped_order = [i.strip('-') for i in args]
-            if not set(stripped_order).issubset(self.fields.keys()):
+            if not set(stripped_order).issubset([*self.fields.keys(), *self.annotations]):
                 raise OrderByFieldError('ordering refers to the nonexistent fields: {}'.
                                         format(', '.join(stripped_order)))
         else:
@@ -276,94 +526,661 @@ class QuerySet:
         if not kwargs:
             raise ValueError("you shoud write params")
 
-        [Condition.check_fields(i, self.model_cls) for i in kwargs.items()]
+        relations = self.model_cls._relations
+        kwargs = {relations[k].column if k in relations else k: Condition.related_value(v) if k in relations else v
+                  for k, v in kwargs.items()}
 
-        query = [sql.SQL('UPDATE {}').format(sql.Identifier(str(self.model_cls._table_name).lower())), sql.SQL('SET'),
-                 sql.SQL(', ').join(
-                     [sql.SQL("{}={}").format(sql.Identifier(i[0]), sql.Literal(i[1])) for i in kwargs.items()])]
-        if self.where:
-            sql_where = [sql.SQL(i) for i in self.format_where()]
-            query.extend([sql.SQL('WHERE'),
-                          sql.SQL('id IN (SELECT id FROM {} WHERE').format(
-                              sql.Identifier(str(self.model_cls._table_name).lower())),
-                          sql.SQL(' AND ').join(sql_where)])
-        if self._order_by:
-            query.extend([sql.SQL("ORDER BY"), sql.SQL(", ").join(self.format_order_list())])
-        if self.limit:
-            query.extend(self.format_limit())
-        query.append(sql.SQL(')'))
+        [Condition.check_fields(i, self.model_cls) for i in kwargs.items()]
 
-        print(' '.join([i.as_string(connection) for i in query]))
-        cursor.execute(' '.join([i.as_string(connection) for i in query]))
-        connection.commit()
-        return cursor.statusmessage.split()[1]
+        def compose():
+            query = [sql.SQL('UPDATE {}').format(sql.Identifier(str(self.model_cls._table_name).lower())),
+                     sql.SQL('SET'),
+                     sql.SQL(', ').join([sql.SQL("{}=%s").format(sql.Identifier(i)) for i in kwargs.keys()])]
+            if self.where:
+                query.extend([sql.SQL('WHERE'),
+                              sql.SQL('id IN (SELECT id FROM {} WHERE').format(
+                                  sql.Identifier(str(self.model_cls._table_name).lower())),
+                              sql.SQL(' AND ').join(self.format_where())])
+            if self._order_by:
+                query.extend([sql.SQL("ORDER BY"), sql.SQL(", ").join(self.format_order_list())])
+            if self.limit is not None:
+                query.extend(self.format_limit())
+            query.append(sql.SQL(')'))
+            return sql.SQL(' ').join(query)
+
+        key = ('update', self.model_cls, tuple(kwargs), self.where_shape(), self.order_shape(), self.limit_shape())
+        params = [*kwargs.values(), *self.where_params(), *self.limit_params()]
+
+        with pool.cursor() as cursor:
+            query = query_cache.compile(key, compose, cursor)
+            execute(cursor, query, params, self.model_cls)
+            commit(cursor.connection)
+            self._invalidate(cursor.connection)
+            return cursor.statusmessage.split()[1]
 
     def delete(self):
-        query = [sql.SQL('DELETE FROM {0} WHERE ctid in (SELECT ctid FROM {0}').format(
-            sql.Identifier(str(self.model_cls._table_name).lower()))]
-        if self.where:
-            query.extend([sql.SQL('WHERE'), sql.SQL(' AND ').join([sql.SQL(i) for i in self.format_where()])])
-        if self._order_by is not None:
-            query.extend([sql.SQL("ORDER BY"), sql.SQL(", ").join(self.format_order_list())])
-        if self.limit:
-            query.extend(self.format_limit())
-        query.append(sql.SQL(')'))
-        # print(' '.join([i.as_string(connection) for i in query]))
-        cursor.execute(' '.join([i.as_string(connection) for i in query]))
-        # connection.commit()
-        return cursor.statusmessage.split()[1]
+        def compose():
+            query = [sql.SQL('DELETE FROM {0} WHERE ctid in (SELECT ctid FROM {0}').format(
+                sql.Identifier(str(self.model_cls._table_name).lower()))]
+            if self.where:
+                query.extend([sql.SQL('WHERE'), sql.SQL(' AND ').join(self.format_where())])
+            if self._order_by:
+                query.extend([sql.SQL("ORDER BY"), sql.SQL(", ").join(self.format_order_list())])
+            if self.limit is not None:
+                query.extend(self.format_limit())
+            query.append(sql.SQL(')'))
+            return sql.SQL(' ').join(query)
+
+        key = ('delete', self.model_cls, self.where_shape(), self.order_shape(), self.limit_shape())
+        params = [*self.where_params(), *self.limit_params()]
+
+        with pool.cursor() as cursor:
+            query = query_cache.compile(key, compose, cursor)
+            execute(cursor, query, params, self.model_cls)
+            commit(cursor.connection)
+            self._invalidate(cursor.connection)
+            return cursor.statusmessage.split()[1]
+
+    def _invalidate(self, conn=None):
+        """Drop cached results and identity map objects of model, any row could be changed by bulk query"""
+        _after_write(str(self.model_cls._table_name).lower(), conn)
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            identity_map.discard_model(self.model_cls)
 
     def count(self):
         if 'count' in self.__cache.keys() and self.__cache['count'] != -1:
             return self.__cache['count']
         return self._count_perform()
 
+    async def acount(self):
+        if self.__cache['count'] != -1:
+            return self.__cache['count']
+        if self.res is None:
+            async with async_pool.connection() as conn:
+                query, params = self._compile_count(conn)
+                self.__cache['count'] = (await self._afetch(conn, query, params))[1][0][0]
+            return self.__cache['count']
+        return self._count_perform()
+
     def _count_perform(self):
         if self.res is not None:
             res_len = len(self.res)
             self.__cache['count'] = res_len
             return res_len
 
-        query = [sql.SQL('SELECT count(*) FROM (SELECT * FROM {}').format(
-            sql.Identifier(str(self.model_cls._table_name).lower()))]
-
-        if self.where:
-            query.extend([sql.SQL('WHERE'), sql.SQL(' AND ').join([sql.SQL(i) for i in self.format_where()])])
-        if self.limit:
-            query.extend(self.format_limit())
-
-        query.append(sql.SQL(') as tmp_table'))
-        print(' '.join([i.as_string(connection) for i in query]))
-        cursor.execute(' '.join([i.as_string(connection) for i in query]))
-        res_len = cursor.fetchone()[0]
+        with self._read_pool().cursor() as cursor:
+            query, params = self._compile_count(cursor)
+            res_len = self._fetch(cursor, query, params)[1][0][0]
         self.__cache['count'] = res_len
         return res_len
 
-    def _build(self):
-        if self.where:
-            [Condition.check_fields(i, self.model_cls) for i in self.where.items()]
+    def _compile_count(self, context):
+        """Return count query with placeholders and its params"""
+        if self.annotations:
+            return self._compile_count_groups(context)
 
-        query = [sql.SQL("SELECT *")]
+        def compose():
+            table = sql.Identifier(str(self.model_cls._table_name).lower())
+            if self.limit is None:
+                query = [sql.SQL('SELECT count(*) FROM {}').format(table)]
+            else:
+                # slice needs subquery, but its rows don't have to carry any column
+                query = [sql.SQL('SELECT count(*) FROM (SELECT 1 FROM {}').format(table)]
+
+            conditions = self.format_conditions()
+            if conditions:
+                query.extend([sql.SQL('WHERE'), sql.SQL(' AND ').join(conditions)])
+            if self.limit is not None:
+                query.extend(self.format_limit())
+                query.append(sql.SQL(') as tmp_table'))
+            return sql.SQL(' ').join(query)
+
+        key = ('count', self.model_cls, self.where_shape(), self.seek_shape(), self.limit_shape())
+        params = [*self.where_params(), *self.seek_params(), *self.limit_params()]
+        return query_cache.compile(key, compose, context), params
+
+    def exists(self):
+        """Check if queryset has any row without counting or fetching them"""
+        if self.res is not None:
+            return bool(self.res)
+        if self.__cache['count'] != -1:
+            return self.__cache['count'] > 0
+
+        start = (self.limit.start or 0) if isinstance(self.limit, slice) else 0
+        if isinstance(self.limit, slice) and self.limit.stop is not None and self.limit.stop <= start:
+            return False
+
+        def compose():
+            if self.annotations:
+                grouped = QuerySet(self.model_cls, self.where, None, self._order_by)
+                grouped.seek, grouped.annotations, grouped.grouping = self.seek, self.annotations, self.grouping
+                query = [sql.SQL('SELECT 1 FROM ({}) AS tmp_table').format(grouped._select_query())]
+            else:
+                query = [sql.SQL('SELECT 1 FROM {}').format(sql.Identifier(str(self.model_cls._table_name).lower()))]
+                conditions = self.format_conditions()
+                if conditions:
+                    query.extend([sql.SQL('WHERE'), sql.SQL(' AND ').join(conditions)])
+            if start:
+                query.extend([sql.SQL('OFFSET'), sql.SQL('%s')])
+            query.append(sql.SQL('LIMIT 1'))
+            return sql.SQL(' ').join(query)
+
+        key = ('exists', self.model_cls, self.where_shape(), self.seek_shape(), self.annotation_shape(), bool(start))
+        params = [*self.where_params(), *self.seek_params(), *([start] if start else [])]
+
+        with self._read_pool().cursor() as cursor:
+            query = query_cache.compile(key, compose, cursor)
+            return bool(self._fetch(cursor, query, params)[1])
+
+    def estimated_count(self):
+        """Approximate number of rows in table from planner statistics
+
+        Filtered, sliced or never analyzed tables are counted exactly."""
+        if self.where or self.limit is not None or self.seek is not None or self.annotations:
+            return self.count()
+
+        with self._read_pool().cursor() as cursor:
+            table = sql.Identifier(str(self.model_cls._table_name).lower()).as_string(cursor)
+            res = self._fetch(cursor, 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])[1]
+        if not res or res[0][0] < 0:
+            return self.count()
+        return res[0][0]
+
+    def format_conditions(self):
+        conditions = self.format_where() or []
+        if self.seek is not None:
+            conditions.append(self.format_seek())
+        return conditions
+
+    def _select_query(self, columns=None):
+        if self.grouping and not self.annotations:
+            # grouped rows aren't model objects, SELECT * can't be grouped
+            raise TypeError("group_by() needs annotate() with aggregates of the groups")
+        if self.annotations and columns:
+            # projection of grouped rows, ordering may refer to aggregates that aren't selected
+            query = [sql.SQL("SELECT {} FROM ({}) AS tmp_table").format(
+                sql.SQL(", ").join([sql.Identifier(i) for i in columns]), self._select_query())]
+            order_by = self._grouped_order()
+            if order_by:
+                query.extend([sql.SQL("ORDER BY"), sql.SQL(", ").join(self.format_order_list(order_by))])
+            return sql.SQL(' ').join(query)
+        if self.annotations:
+            query = [sql.SQL("SELECT {}").format(sql.SQL(", ").join(
+                [*[sql.Identifier(i) for i in self.grouping], *self.format_aggregates(self.annotations)]))]
+        elif columns:
+            query = [sql.SQL("SELECT {}").format(sql.SQL(", ").join([sql.Identifier(i) for i in columns]))]
+        else:
+            query = [sql.SQL("SELECT *")]
         query.extend([sql.SQL("FROM"), sql.Identifier(str(self.model_cls._table_name).lower())])
 
-        if self.where:
-            query.extend([sql.SQL("WHERE"), sql.SQL(" AND ").join([sql.SQL(i) for i in self.format_where()])])
-        if self._order_by:
-            query.extend([sql.SQL("ORDER BY"), sql.SQL(", ").join(self.format_order_list())])
-        if self.limit:
+        conditions = self.format_conditions()
+        if conditions:
+            query.extend([sql.SQL("WHERE"), sql.SQL(" AND ").join(conditions)])
+        if self.grouping:
+            query.extend([sql.SQL("GROUP BY"), sql.SQL(", ").join([sql.Identifier(i) for i in self.grouping])])
+
+        order_by = self._grouped_order() if self.annotations else self._order_by
+        if order_by:
+            query.extend([sql.SQL("ORDER BY"), sql.SQL(", ").join(self.format_order_list(order_by))])
+        if self.limit is not None:
             query.extend(self.format_limit())
+        return sql.SQL(' ').join(query)
+
+    def _compile_select(self, context, columns=None, related=()):
+        """Return SQL string with placeholders and its params, related relations are joined"""
+        params = [*self.where_params(), *self.seek_params(), *self.limit_params()]
+        key = ('select', self.model_cls, tuple(columns or ()), self.where_shape(), self.seek_shape(),
+               self.annotation_shape(), self.order_shape(), self.limit_shape(), tuple(related))
+        if related:
+            return query_cache.compile(key, lambda: self._select_related_query(related, columns), context), params
+        return query_cache.compile(key, lambda: self._select_query(columns), context), params
+
+    def _select_related_query(self, related, columns=None):
+        """Join select query as subquery with tables of related relations, their columns are named relation__column"""
+        base = sql.Identifier('t')
+        selected = [sql.SQL("{}.*").format(base)]
+        joins = []
+        for n, name in enumerate(related, 1):
+            relation = self.model_cls._relations[name]
+            alias = sql.Identifier('t{}'.format(n))
+            selected.extend(sql.SQL("{}.{} AS {}").format(alias, sql.Identifier(i),
+                                                          sql.Identifier('{}__{}'.format(name, i)))
+                            for i in ['id', *relation.to._fields])
+            joins.append(sql.SQL("LEFT JOIN {} AS {} ON {}.id = {}.{}").format(
+                sql.Identifier(str(relation.to._table_name).lower()), alias, alias, base,
+                sql.Identifier(relation.column)))
+
+        query = [sql.SQL("SELECT {} FROM ({}) AS {}").format(sql.SQL(', ').join(selected),
+                                                             self._select_query(columns), base), *joins]
+        if self._order_by:
+            query.extend([sql.SQL("ORDER BY"), sql.SQL(", ").join(self.format_order_list(table='t'))])
+        return sql.SQL(' ').join(query)
+
+    def select_related(self, *names):
+        """Load objects of given foreign keys in the same query with LEFT JOIN"""
+        self._check_relations(names)
+        self.related = [*self.related, *[i for i in names if i not in self.related]]
+        return self
+
+    def prefetch_related(self, *names):
+        """Load objects of given foreign keys with one query per relation after the main query"""
+        self._check_relations(names)
+        self.prefetch = [*self.prefetch, *[i for i in names if i not in self.prefetch]]
+        return self
+
+    def _check_relations(self, names):
+        for i in names:
+            if i not in self.model_cls._relations:
+                raise LookupError("Cannot resolve relation '{}'. Choices are: {}".
+                                  format(i, ', '.join(self.model_cls._relations)))
+
+    def _joined(self):
+        return () if self.annotations else tuple(self.related)
+
+    def _prefetch_querysets(self, objs):
+        """Pairs of relation and queryset of its objects referenced by objs"""
+        for name in self.prefetch:
+            relation = self.model_cls._relations[name]
+            ids = {getattr(obj, relation.column) for obj in objs} - {None}
+            if ids:
+                qs = QuerySet(relation.to, {'id__in': list(ids)}, order_by=[])
+                qs._using = self._using
+                yield relation, qs
 
-        # print('BUILD QUERY', query)
-        print(' '.join([i.as_string(connection) for i in query]))
+    @staticmethod
+    def _attach(relation, objs, related):
+        related = {i.id: i for i in related}
+        for obj in objs:
+            related_obj = related.get(getattr(obj, relation.column))
+            if related_obj is not None:
+                relation.cache(obj, related_obj)
+
+    def _prefetch(self, objs):
+        if self.annotations:
+            return
+        for relation, qs in self._prefetch_querysets(objs):
+            self._attach(relation, objs, list(qs))
+
+    async def _aprefetch(self, objs):
+        if self.annotations:
+            return
+        for relation, qs in self._prefetch_querysets(objs):
+            self._attach(relation, objs, [i async for i in qs])
+
+    def _check_aggregates(self, aggregates):
+        if not aggregates:
+            raise ValueError("you should write aggregates")
+        for name, aggregate in aggregates.items():
+            if not isinstance(aggregate, Aggregate):
+                raise TypeError("'{}' is not an aggregate".format(name))
+            if name in ['id', *self.fields.keys()]:
+                raise ValueError("aggregate name '{}' conflicts with a field on the model".format(name))
+            aggregate.check_field(self.model_cls)
+
+    @staticmethod
+    def format_aggregates(aggregates):
+        return [sql.SQL("{} AS {}").format(aggregate.format(), sql.Identifier(name))
+                for name, aggregate in aggregates.items()]
+
+    def annotation_shape(self):
+        if not self.annotations and not self.grouping:
+            return ()
+        return tuple((name, aggregate.shape()) for name, aggregate in self.annotations.items()), tuple(self.grouping)
+
+    def _grouped_order(self):
+        # default model ordering may refer to columns that are neither grouped nor aggregated
+        allowed = {*self.grouping, *self.annotations}
+        return [i for i in self._order_by or () if i.strip('-') in allowed]
+
+    def aggregate(self, **aggregates):
+        """Compute aggregates over the queryset in database, returns dict of their values"""
+        if self.annotations:
+            raise TypeError("aggregate() can't be used on annotated queryset")
+        self._check_aggregates(aggregates)
+
+        def compose():
+            columns = sql.SQL(', ').join(self.format_aggregates(aggregates))
+            if self.limit is not None:
+                # aggregate only rows of the slice
+                return sql.SQL("SELECT {} FROM ({}) AS tmp_table").format(columns, self._select_query())
+
+            query = [sql.SQL("SELECT {} FROM {}").format(
+                columns, sql.Identifier(str(self.model_cls._table_name).lower()))]
+            conditions = self.format_conditions()
+            if conditions:
+                query.extend([sql.SQL("WHERE"), sql.SQL(" AND ").join(conditions)])
+            return sql.SQL(' ').join(query)
+
+        key = ('aggregate', self.model_cls, tuple((name, i.shape()) for name, i in aggregates.items()),
+               self.where_shape(), self.seek_shape(),
+               self.order_shape() if self.limit is not None else (), self.limit_shape())
+        params = [*self.where_params(), *self.seek_params(), *self.limit_params()]
+
+        with self._read_pool().cursor() as cursor:
+            query = query_cache.compile(key, compose, cursor)
+            names, res = self._fetch(cursor, query, params)
+        return dict(zip(names, res[0]))
+
+    def annotate(self, **aggregates):
+        """Compute aggregates per group of group_by fields, rows are returned as dicts"""
+        self._check_aggregates(aggregates)
+        self.annotations = {**self.annotations, **aggregates}
+        return self
 
-        cursor.execute(' '.join([i.as_string(connection) for i in query]))
-        res = cursor.fetchall()
+    def group_by(self, *fields):
+        self._check_projection(fields)
+        self.grouping = [*self.grouping, *[i for i in fields if i not in self.grouping]]
+        return self
+
+    def _compile_count_groups(self, context):
+        def compose():
+            return sql.SQL("SELECT count(*) FROM ({}) AS tmp_table").format(self._select_query())
+
+        key = ('count', self.model_cls, self.where_shape(), self.seek_shape(), self.annotation_shape(),
+               self.order_shape(), self.limit_shape())
+        params = [*self.where_params(), *self.seek_params(), *self.limit_params()]
+        return query_cache.compile(key, compose, context), params
+
+    def _seek_terms(self):
+        """Disjunction of conjunctions (column, operator, value) selecting rows after seek values
+
+        Ascending columns sort nulls first and descending ones nulls last, like format_order_list."""
+        order, values = self.seek
+        terms = []
+        for n, (column, value) in enumerate(zip(order, values)):
+            term = [(i.strip('-'), 'is null' if v is None else '=', v) for i, v in zip(order[:n], values[:n])]
+            if column.startswith('-'):
+                if value is None:
+                    continue
+                term.append((column.strip('-'), '< or null', value))
+            else:
+                term.append((column, 'is not null' if value is None else '>', value))
+            terms.append(term)
+        return terms
+
+    def _seek_by_row(self):
+        order, values = self.seek
+        return not any(i.startswith('-') for i in order) and None not in values
+
+    def format_seek(self):
+        order, values = self.seek
+        if self._seek_by_row():
+            # row comparison can use composite index on ordering columns
+            return sql.SQL("({}) > ({})").format(sql.SQL(', ').join([sql.Identifier(i) for i in order]),
+                                                 sql.SQL(', ').join([sql.Placeholder()] * len(order)))
+
+        templates = {'=': "{}=%s", 'is null': "{} IS NULL", '>': "{} > %s",
+                     'is not null': "{} IS NOT NULL", '< or null': "({} < %s OR {} IS NULL)"}
+        terms = [sql.SQL("({})").format(sql.SQL(' AND ').join(
+            [sql.SQL(templates[op]).format(*[sql.Identifier(column)] * templates[op].count('{}'))
+             for column, op, value in term])) for term in self._seek_terms()]
+        if not terms:
+            return sql.SQL('FALSE')
+        return sql.SQL("({})").format(sql.SQL(' OR ').join(terms))
+
+    def seek_params(self):
+        if self.seek is None:
+            return []
+        if self._seek_by_row():
+            return list(self.seek[1])
+        return [value for term in self._seek_terms() for column, op, value in term if op in ('=', '>', '< or null')]
+
+    def seek_shape(self):
+        if self.seek is None:
+            return None
+        return tuple(self.seek[0]), tuple(i is None for i in self.seek[1])
+
+    def paginate_after(self, after=None, size=20):
+        """Get page of objects following after, which is object, tuple of ordering values or page cursor
+
+        Uses seek condition on ordering columns plus id instead of OFFSET, so every page costs the same."""
+        if size < 1:
+            raise ValueError("page size must be positive")
+        if self.limit is not None:
+            raise TypeError("sliced queryset can't be paginated")
+
+        order = list(self._order_by or [])
+        if not any(i.strip('-') == 'id' for i in order):
+            order.append('id')
+
+        qs = QuerySet(self.model_cls, dict(self.where) if self.where else None, slice(None, size + 1, None), order)
+        qs.deferred = set(self.deferred)
+        qs.use_cache, qs.cache_ttl = self.use_cache, self.cache_ttl
+        qs._using = self._using
+        qs.related, qs.prefetch = list(self.related), list(self.prefetch)
+
+        if after is not None:
+            if isinstance(after, str):
+                values = Page.decode_cursor(after, order)
+            elif isinstance(after, Model):
+                values = [getattr(after, i.strip('-')) for i in order]
+            else:
+                values = list(after)
+            if len(values) != len(order):
+                raise ValueError("pagination needs values of {}".format(', '.join(order)))
+            qs.seek = (order, values)
+
+        objs = list(qs)
+        if len(objs) > size:
+            objs = objs[:size]
+            return Page(objs, Page.encode_cursor(order, [getattr(objs[-1], i.strip('-')) for i in order]))
+        return Page(objs, None)
+
+    def _select_columns(self):
+        if self.deferred and not self.annotations:
+            # joins need id columns of related objects
+            deferred = self.deferred - {self.model_cls._relations[i].column for i in self._joined()}
+            return ['id', *[i for i in self.fields.keys() if i not in deferred]]
+        return None
+
+    def _hydrate(self, names, rows, related=()):
+        if self.annotations:
+            return [dict(zip(names, row)) for row in rows]
+
+        relations = [self.model_cls._relations[i] for i in related]
+        width = len(names) - sum(1 + len(i.to._fields) for i in relations)
+        decode = self.model_cls.row_decoder(names[:width])
+        objs = [decode(row[:width] if related else row) for row in rows]
+        if self.deferred:
+            loader = DeferredLoader(self.model_cls, objs, self._using)
+            for obj in objs:
+                obj.defer_fields(self.deferred - set(names[:width]), loader)
+
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            objs = [identity_map.add(obj) for obj in objs]
+
+        start = width
+        for relation in relations:
+            end = start + 1 + len(relation.to._fields)
+            decode = relation.to.row_decoder([i.split('__', 1)[1] for i in names[start:end]])
+            for obj, row in zip(objs, rows):
+                if row[start] is not None:
+                    related_obj = decode(row[start:end])
+                    if identity_map is not None:
+                        related_obj = identity_map.add(related_obj)
+                    relation.cache(obj, related_obj)
+            start = end
+        return objs
+
+    def _build(self):
+        related = self._joined()
+        with self._read_pool().cursor() as cursor:
+            query, params = self._compile_select(cursor, self._select_columns(), related)
+            names, res = self._fetch(cursor, query, params)
+
+        if isinstance(self.limit, int):
+            res = res[:1]
+        objs = self._hydrate(names, res, related)
+        self._prefetch(objs)
 
         if isinstance(self.limit, int):
-            return self.model_cls(**dict(zip([i.name for i in cursor.description], res[0])))
+            return objs[0]
+        self.res = objs
+
+    async def _abuild(self):
+        related = self._joined()
+        async with async_pool.connection() as conn:
+            query, params = self._compile_select(conn, self._select_columns(), related)
+            names, res = await self._afetch(conn, query, params)
+        objs = self._hydrate(names, res, related)
+        await self._aprefetch(objs)
+        self.res = objs
+
+    def only(self, *fields):
+        """Load only given fields, others are loaded on first access"""
+        self._check_projection(fields)
+        self.deferred = {i for i in self.fields.keys() if i not in fields}
+        return self
 
-        self.res = [self.model_cls(**dict(zip([ii.name for ii in cursor.description], res[i]))) for i in
-                    range(len(res))]
+    def defer(self, *fields):
+        """Don't load given fields until they are accessed"""
+        self._check_projection(fields)
+        self.deferred = self.deferred | (set(fields) - {'id'})
+        return self
+
+    def _check_projection(self, fields):
+        for i in fields:
+            if i not in ['id', *self.fields.keys()]:
+                raise LookupError("Cannot resolve keyword '{}' into field. Choices are: {}".
+                                  format(i, ', '.join(self.fields.keys())))
+
+    def _value_columns(self, fields):
+        if self.annotations:
+            # grouped rows have only grouping columns and annotations
+            names = [*self.grouping, *self.annotations]
+            for i in fields:
+                if i not in names:
+                    raise LookupError("Cannot resolve keyword '{}' of grouped rows. Choices are: {}".
+                                      format(i, ', '.join(names)))
+            return list(fields or names)
+        if not fields:
+            return ['id', *self.fields.keys()]
+        for i in fields:
+            if i not in ['id', *self.fields.keys()]:
+                raise LookupError("Cannot resolve keyword '{}' into field. Choices are: {}".
+                                  format(i, ', '.join(['id', *self.fields.keys()])))
+        return list(fields)
+
+    def _fetch_values(self, columns):
+        with self._read_pool().cursor() as cursor:
+            query, params = self._compile_select(cursor, columns)
+            return self._fetch(cursor, query, params)[1]
+
+    def using(self, alias):
+        """Read from 'primary', any 'replica' or replica with given name"""
+        router.db_for_read(alias)
+        self._using = alias
+        return self
+
+    def _read_pool(self):
+        return router.db_for_read(self._using)
+
+    def cached(self, ttl=None):
+        """Read results through result cache, ttl defaults to backend ttl"""
+        self.use_cache = True
+        self.cache_ttl = ttl
+        return self
+
+    def _tables(self):
+        """Tables results of queryset are read from, writes to any of them invalidate cached results"""
+        return [str(self.model_cls._table_name).lower(),
+                *[str(self.model_cls._relations[i].to._table_name).lower() for i in self._joined()]]
+
+    def _fetch(self, cursor, query, params):
+        """Execute query and return column names and rows, cached querysets use result cache
+
+        Reads inside atomic block bypass the cache, they see uncommitted rows of the block."""
+        backend = get_result_cache() if self.use_cache and not in_atomic(cursor.connection) else None
+        if backend is not None:
+            key = cache_key(query, params)
+            res = backend.get(key)
+            if res is not None:
+                return res[0], list(res[1])
+
+        execute(cursor, query, params, self.model_cls)
+        res = [i.name for i in cursor.description], cursor.fetchall()
+
+        if backend is not None:
+            backend.set(key, res, self.cache_ttl, self._tables())
+            return res[0], list(res[1])
+        return res
+
+    async def _afetch(self, conn, query, params):
+        """Asynchronous _fetch on connection from async_pool"""
+        backend = get_result_cache() if self.use_cache else None
+        if backend is not None:
+            key = cache_key(query, params)
+            res = backend.get(key)
+            if res is not None:
+                return res[0], list(res[1])
+
+        cursor = await async_execute(conn, query, params, self.model_cls)
+        res = [i.name for i in cursor.description], cursor.fetchall()
+
+        if backend is not None:
+            backend.set(key, res, self.cache_ttl, self._tables())
+            return res[0], list(res[1])
+        return res
+
+    def values(self, *fields):
+        """Get rows as dicts of selected columns without creating model objects"""
+        columns = self._value_columns(fields)
+        return [dict(zip(columns, row)) for row in self._fetch_values(columns)]
+
+    def values_list(self, *fields, flat=False):
+        """Get rows as tuples of selected columns without creating model objects"""
+        if flat and len(fields) != 1:
+            raise TypeError("'flat' is not valid when values_list is called with more than one field")
+        rows = self._fetch_values(self._value_columns(fields))
+        if flat:
+            return [row[0] for row in rows]
+        return rows
+
+    def iterator(self, chunk_size=2000):
+        """Stream objects with server-side cursor, results are not stored in queryset"""
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+
+        # inside atomic block nothing commits until block exits, so thread connection is safe to use
+        read_pool = self._read_pool()
+        current = read_pool.current()
+        with read_pool.connection() if current is not None and in_atomic(current) else read_pool.detached() as conn:
+            # named cursor lives in transaction, pool turns autocommit back on when connection is returned
+            if conn.autocommit:
+                conn.autocommit = False
+            with conn.cursor(name='qs_iter_{}'.format(next(_cursor_counter))) as cursor:
+                cursor.itersize = chunk_size
+                related = self._joined()
+                query, params = self._compile_select(conn, self._select_columns(), related)
+                execute(cursor, query, params, self.model_cls)
+
+                rows = cursor.fetchmany(chunk_size)
+                names = [i.name for i in cursor.description]
+                while rows:
+                    objs = self._hydrate(names, rows, related)
+                    self._prefetch(objs)
+                    yield from objs
+                    rows = cursor.fetchmany(chunk_size)
+
+    def copy_to(self, file, format='csv', header=False):
+        """Export rows to file object with COPY, returns number of copied rows"""
+        if format not in ('csv', 'binary'):
+            raise ValueError("copy format can be only 'csv' or 'binary'")
+
+        options = [sql.SQL('FORMAT {}').format(sql.SQL(format))]
+        if header and format == 'csv':
+            options.append(sql.SQL('HEADER'))
+
+        with self._read_pool().cursor() as cursor:
+            # COPY doesn't accept bind parameters, so values are interpolated on client side
+            query, params = self._compile_select(cursor, None if self.annotations else ['id', *self.fields.keys()])
+            copy_query = sql.SQL("COPY ({}) TO STDOUT WITH ({})").format(
+                sql.SQL(cursor.mogrify(query, params).decode(extensions.encodings[cursor.connection.encoding])),
+                sql.SQL(', ').join(options)).as_string(cursor)
+            run(cursor, copy_query, None, self.model_cls, cursor.copy_expert, copy_query, file)
+            return cursor.rowcount
 
     def __str__(self):
         return '<QuerySet of {}>'.format(self.model_cls._table_name)
@@ -374,54 +1191,145 @@ class QuerySet:
 
         return iter(self.res)
 
+    async def __aiter__(self):
+        if self.res is None:
+            await self._abuild()
+
+        for obj in self.res:
+            yield obj
+
 
 class Manage:
     def __init__(self):
         self.model_cls = None
+        self._managers = {}
+        self._using = None
 
     def __get__(self, instance, owner):
         if self.model_cls is None:
             self.model_cls = owner
+        if self.model_cls is not owner:
+            if owner not in self._managers:
+                manager = type(self)()
+                manager.model_cls = owner
+                self._managers[owner] = manager
+            return self._managers[owner]
         return self
 
+    def using(self, alias):
+        """Manager reading from 'primary', any 'replica' or replica with given name"""
+        router.db_for_read(alias)
+        manager = type(self)()
+        manager.model_cls = self.model_cls
+        manager._using = alias
+        return manager
+
+    def _queryset(self, where=None):
+        qs = QuerySet(self.model_cls, where)
+        qs._using = self._using
+        return qs
+
     def all(self):
         """Get all rows from table"""
-        return QuerySet(self.model_cls)
+        return self._queryset()
 
     def filter(self, *_, **kwargs):
         """Get rows that are suitable for condition"""
         [Condition.check_fields(i, self.model_cls) for i in kwargs.items()]
-        return QuerySet(self.model_cls, kwargs)
+        return self._queryset(kwargs)
+
+    def only(self, *fields):
+        return self._queryset().only(*fields)
+
+    def defer(self, *fields):
+        return self._queryset().defer(*fields)
 
     def get(self, *_, **kwargs):
         """Get only one object"""
+        obj = self._identity_get(kwargs)
+        if obj is not None:
+            return obj
+
+        with router.db_for_read(self._using).cursor() as cursor:
+            key, select_get_query, params = self._compile_get(kwargs, cursor)
+            execute_prepared(cursor, key, select_get_query, params, self.model_cls)
+            res = cursor.fetchall()
+            names = [i.name for i in cursor.description]
+        return self._get_result(names, res)
+
+    async def aget(self, *_, **kwargs):
+        """Get only one object without blocking event loop"""
+        obj = self._identity_get(kwargs)
+        if obj is not None:
+            return obj
+
+        async with async_pool.connection() as conn:
+            key, select_get_query, params = self._compile_get(kwargs, conn)
+            cursor = await async_execute(conn, select_get_query, params, self.model_cls)
+            res = cursor.fetchall()
+            names = [i.name for i in cursor.description]
+        return self._get_result(names, res)
+
+    def _identity_get(self, kwargs):
+        identity_map = current_identity_map()
+        if identity_map is not None and len(kwargs) == 1 and ('id' in kwargs or 'id__exact' in kwargs):
+            try:
+                return identity_map.get(self.model_cls, int(kwargs.get('id', kwargs.get('id__exact'))))
+            except (TypeError, ValueError):
+                return None
+        return None
+
+    def _compile_get(self, kwargs, context):
         if not kwargs:
             raise ValueError("you should write params")
 
-        where_list = []
-        for i in kwargs.items():
-            where_list.append(Condition(i, self.model_cls).format_cond())
+        conditions = [Condition(i, self.model_cls) for i in kwargs.items()]
+        params = [i.format_param() for i in conditions]
 
-        select_get_query = sql.SQL("SELECT * FROM {} WHERE {};").format(
-            sql.Identifier(str(self.model_cls._table_name).lower()),
-            sql.SQL(' AND ').join([sql.SQL(i) for i in where_list]))
+        def compose():
+            return sql.SQL("SELECT * FROM {} WHERE {};").format(
+                sql.Identifier(str(self.model_cls._table_name).lower()),
+                sql.SQL(' AND ').join([i.format_cond() for i in conditions]))
 
-        print(select_get_query.as_string(connection))
-        cursor.execute(select_get_query.as_string(connection))
-        res = cursor.fetchall()
+        key = ('get', self.model_cls, tuple(kwargs))
+        return key, query_cache.compile(key, compose, context), params
 
+    def _get_result(self, names, res):
         if len(res) > 1:
             raise MultipleObjectsReturned('get() returned more than one {} -- it returned {}!'.
                                           format(self.model_cls._table_name, len(res)))
         elif len(res) == 0:
             raise DoesNotExist('{} matching query does not exist.'.
                                format(self.model_cls._table_name))
-        else:
-            res_d = dict(zip([i.name for i in cursor.description], res[0]))
-        return self.model_cls(**res_d)
+
+        obj = self.model_cls.row_decoder(names)(res[0])
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            return identity_map.add(obj)
+        return obj
 
     def create(self, *_, **kwargs):
         """Create object"""
+        key, compose, params = self._create_query(kwargs)
+        with pool.cursor() as cursor:
+            insert_query = query_cache.compile(key, compose, cursor)
+            execute(cursor, insert_query, params, self.model_cls)
+            res = dict(zip([i.name for i in cursor.description], cursor.fetchone()))
+            commit(cursor.connection)
+            _after_write(str(self.model_cls._table_name).lower(), cursor.connection)
+        return self.model_cls.from_db(**res)
+
+    async def acreate(self, *_, **kwargs):
+        """Create object without blocking event loop"""
+        key, compose, params = self._create_query(kwargs)
+        async with async_pool.connection() as conn:
+            cursor = await async_execute(conn, query_cache.compile(key, compose, conn), params, self.model_cls)
+            res = dict(zip([i.name for i in cursor.description], cursor.fetchone()))
+        _after_write(str(self.model_cls._table_name).lower())
+        return self.model_cls.from_db(**res)
+
+    def _create_query(self, kwargs):
+        """Validate values and return cache key, compose function and params of INSERT"""
         if not kwargs:
             raise IntegrityError("no parameters to create")
 
@@ -430,35 +1338,473 @@ class Manage:
                                                                        field_name) == "None") and field.required:
                 raise IntegrityError('NOT NULL constraint failed: {} in {} column'
                                      .format(getattr(self.model_cls, field_name), field_name))
+        relations = self.model_cls._relations
+        kwargs = {relations[k].column if k in relations else k: Condition.related_value(v) if k in relations else v
+                  for k, v in kwargs.items()}
         edited_kw = {}
         for field_name, field in kwargs.items():
-            value = getattr(self.model_cls, field_name).validate(kwargs.get(field_name))
+            value = self.model_cls._fields[field_name].validate(kwargs.get(field_name))
             edited_kw[field_name] = value
 
-        insert_query = sql.SQL("INSERT INTO {0} ({1}) VALUES ({2}) RETURNING *;").format(
-            sql.Identifier(str(self.model_cls._table_name).lower()),
-            sql.SQL(', ').join([sql.Identifier(i) for i in edited_kw.keys()]),
-            sql.SQL(', ').join([sql.Literal(i) for i in edited_kw.values()]))
+        def compose():
+            return sql.SQL("INSERT INTO {0} ({1}) VALUES ({2}) RETURNING *;").format(
+                sql.Identifier(str(self.model_cls._table_name).lower()),
+                sql.SQL(', ').join([sql.Identifier(i) for i in edited_kw.keys()]),
+                sql.SQL(', ').join([sql.Placeholder()] * len(edited_kw)))
+
+        return ('create', self.model_cls, tuple(edited_kw)), compose, list(edited_kw.values())
+
+    def bulk_create(self, objs, batch_size=1000):
+        """Insert objects with multi-row INSERTs in one transaction and set their ids"""
+        objs = list(objs)
+        if not objs:
+            return objs
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be positive")
+
+        field_names = list(self.model_cls._fields.keys())
+        self._validate_objects(objs, field_names, 'bulk_create')
+
+        with_id = [obj for obj in objs if obj.id is not None]
+        without_id = [obj for obj in objs if obj.id is None]
+        table = sql.Identifier(str(self.model_cls._table_name).lower())
+
+        with _write_block(), pool.cursor() as cursor:
+            for group, columns in ((with_id, ['id', *field_names]), (without_id, field_names)):
+                if not group:
+                    continue
+
+                insert_query = query_cache.compile(
+                    ('bulk_create', self.model_cls, tuple(columns)),
+                    lambda: sql.SQL("INSERT INTO {0} ({1}) VALUES %s RETURNING id").format(
+                        table, sql.SQL(', ').join([sql.Identifier(i) for i in columns])),
+                    cursor)
+                ids = run(cursor, insert_query, None, self.model_cls, execute_values, cursor, insert_query,
+                          [tuple(getattr(obj, i) for i in columns) for obj in group],
+                          page_size=batch_size or len(group), fetch=True)
+                for obj, row in zip(group, ids):
+                    obj.id = row[0]
+            _after_write(str(self.model_cls._table_name).lower(), cursor.connection)
+        for obj in objs:
+            obj.mark_saved()
+        return objs
+
+    def _validate_objects(self, objs, field_names, method):
+        for obj in objs:
+            if not isinstance(obj, self.model_cls):
+                raise TypeError("{}() expects {} objects, got {}".
+                                format(method, self.model_cls.__name__, type(obj).__name__))
+            for field_name in field_names:
+                object.__setattr__(obj, field_name, self.model_cls._fields[field_name].validate(
+                    getattr(obj, field_name)))
+            obj.check_fields(field_names)
+
+    def _check_field_names(self, field_names):
+        for i in field_names:
+            if i not in self.model_cls._fields:
+                raise LookupError("Cannot resolve keyword '{}' into field. Choices are: {}".
+                                  format(i, ', '.join(self.model_cls._fields.keys())))
+
+    def bulk_update(self, objs, fields, batch_size=1000):
+        """Write given fields of objects with one UPDATE ... FROM (VALUES ...) per batch"""
+        objs = list(objs)
+        fields = list(fields)
+        if not fields:
+            raise ValueError("field names must be given to bulk_update()")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        self._check_field_names(fields)
+        if any(obj.id is None for obj in objs):
+            raise ValueError("all bulk_update() objects must have id")
+        if not objs:
+            return 0
+
+        self._validate_objects(objs, fields, 'bulk_update')
+        count = self._update_objects(objs, fields, batch_size)
+        for obj in objs:
+            changed = getattr(obj, '_changed', None)
+            if changed:
+                for field_name in fields:
+                    changed.pop(field_name, None)
+        return count
+
+    def bulk_upsert(self, objs, conflict_fields, update_fields=None, batch_size=1000):
+        """Insert objects or update rows that conflict on conflict_fields with INSERT ... ON CONFLICT
+
+        conflict_fields need unique index, update_fields default to all other fields.
+        Objects get ids of inserted or updated rows. With empty update_fields existing rows
+        are left as is and only objects of inserted rows get ids.
+        Every conflict key must appear once, Postgres can't update a row twice in one query."""
+        objs = list(objs)
+        conflict_fields = list(conflict_fields)
+        if not conflict_fields:
+            raise ValueError("conflict_fields must be given to bulk_upsert()")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be positive")
+
+        field_names = list(self.model_cls._fields.keys())
+        self._check_field_names([i for i in conflict_fields if i != 'id'])
+        if update_fields is None:
+            update_fields = [i for i in field_names if i not in conflict_fields]
+        update_fields = list(update_fields)
+        self._check_field_names(update_fields)
+        if not objs:
+            return objs
+
+        self._validate_objects(objs, field_names, 'bulk_upsert')
+        if 'id' in conflict_fields and any(obj.id is None for obj in objs):
+            raise ValueError("objects must have ids when id is in conflict_fields")
+        conflict_key = operator.attrgetter(*conflict_fields) if len(conflict_fields) > 1 \
+            else lambda obj: (getattr(obj, conflict_fields[0]),)
+        seen = set()
+        for obj in objs:
+            key = conflict_key(obj)
+            # NULLs never conflict
+            if None in key:
+                continue
+            if key in seen:
+                raise ValueError("duplicate conflict key {} in bulk_upsert()".format(
+                    ', '.join('{}={!r}'.format(i, j) for i, j in zip(conflict_fields, key))))
+            seen.add(key)
+        columns = ['id', *field_names] if 'id' in conflict_fields else field_names
+
+        def compose():
+            if update_fields:
+                action = sql.SQL("DO UPDATE SET {}").format(sql.SQL(', ').join(
+                    [sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(i)) for i in update_fields]))
+            else:
+                action = sql.SQL("DO NOTHING")
+            # skipped rows aren't returned, so inserted ones are matched back by conflict key
+            returning = ['id'] if update_fields else ['id', *conflict_fields]
+            return sql.SQL("INSERT INTO {0} ({1}) VALUES %s ON CONFLICT ({2}) {3} RETURNING {4}").format(
+                sql.Identifier(str(self.model_cls._table_name).lower()),
+                sql.SQL(', ').join([sql.Identifier(i) for i in columns]),
+                sql.SQL(', ').join([sql.Identifier(i) for i in conflict_fields]),
+                action,
+                sql.SQL(', ').join([sql.Identifier(i) for i in returning]))
+
+        batch_size = batch_size or len(objs)
+        with _write_block(), pool.cursor() as cursor:
+            query = query_cache.compile(('bulk_upsert', self.model_cls, tuple(conflict_fields),
+                                         tuple(update_fields)), compose, cursor)
+            for start in range(0, len(objs), batch_size):
+                batch = objs[start:start + batch_size]
+                ids = run(cursor, query, None, self.model_cls, execute_values, cursor, query,
+                          [tuple(getattr(obj, i) for i in columns) for obj in batch], page_size=batch_size, fetch=True)
+                if update_fields:
+                    for obj, row in zip(batch, ids):
+                        obj.id = row[0]
+                        obj.mark_saved()
+                else:
+                    # returned rows keep order of batch
+                    rows = iter(ids)
+                    row = next(rows, None)
+                    for obj in batch:
+                        if row is not None and tuple(row[1:]) == conflict_key(obj):
+                            obj.id = row[0]
+                            obj.mark_saved()
+                            row = next(rows, None)
+            _after_write(str(self.model_cls._table_name).lower(), cursor.connection)
+
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            identity_map.discard_model(self.model_cls)
+        return objs
+
+    def _update_objects(self, objs, field_names, batch_size=1000):
+        """Write given fields of objects with UPDATE ... FROM (VALUES ...), returns number of updated rows"""
+        columns = ['id', *field_names]
+        casts = ['integer', *[self.model_cls._fields[i].db_type for i in field_names]]
+        template = '({})'.format(', '.join(['%s::{}'.format(i) if i else '%s' for i in casts]))
+        batch_size = batch_size or len(objs)
+
+        def compose():
+            return sql.SQL("UPDATE {0} AS t SET {1} FROM (VALUES %s) AS v ({2}) WHERE t.id = v.id").format(
+                sql.Identifier(str(self.model_cls._table_name).lower()),
+                sql.SQL(', ').join([sql.SQL("{0} = v.{0}").format(sql.Identifier(i)) for i in field_names]),
+                sql.SQL(', ').join([sql.Identifier(i) for i in columns]))
+
+        count = 0
+        with _write_block(), pool.cursor() as cursor:
+            query = query_cache.compile(('update_objects', self.model_cls, tuple(field_names)), compose, cursor)
+            for start in range(0, len(objs), batch_size):
+                run(cursor, query, None, self.model_cls, execute_values, cursor, query,
+                    [tuple(getattr(obj, i) for i in columns) for obj in objs[start:start + batch_size]],
+                    template=template, page_size=batch_size)
+                count += cursor.rowcount
+            _after_write(str(self.model_cls._table_name).lower(), cursor.connection)
+        return count
+
+    def _delete_ids(self, ids):
+        """Delete rows with DELETE ... WHERE id = ANY(...), returns number of deleted rows"""
+        ids = list(ids)
+
+        def compose():
+            return sql.SQL("DELETE FROM {} WHERE id = ANY(%s)").format(
+                sql.Identifier(str(self.model_cls._table_name).lower()))
+
+        with pool.cursor() as cursor:
+            query = query_cache.compile(('delete_ids', self.model_cls), compose, cursor)
+            execute(cursor, query, [ids], self.model_cls)
+            commit(cursor.connection)
+            _after_write(str(self.model_cls._table_name).lower(), cursor.connection)
+            count = cursor.rowcount
+
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            for obj_id in ids:
+                identity_map.discard(self.model_cls, obj_id)
+        return count
+
+    def copy_from(self, source, columns=None, format='text'):
+        """Load rows with COPY from file object or iterable of objects, dicts or tuples"""
+        if columns is None:
+            columns = list(self.model_cls._fields.keys())
+        [Condition.check_fields((i, None), self.model_cls) for i in columns]
+
+        if format not in ('text', 'csv', 'binary'):
+            raise ValueError("copy format can be only 'text', 'csv' or 'binary'")
+
+        if hasattr(source, 'read'):
+            stream = source
+        else:
+            if format != 'text':
+                raise ValueError("only text format can be used to copy from iterable")
+            stream = CopyStream(self._copy_rows(source, columns))
+
+        with pool.cursor() as cursor:
+            copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT {})").format(
+                sql.Identifier(str(self.model_cls._table_name).lower()),
+                sql.SQL(', ').join([sql.Identifier(i) for i in columns]),
+                sql.SQL(format)).as_string(cursor)
+            run(cursor, copy_query, None, self.model_cls, cursor.copy_expert, copy_query, stream)
+            commit(cursor.connection)
+            _after_write(str(self.model_cls._table_name).lower(), cursor.connection)
+            return cursor.rowcount
+
+    def _copy_rows(self, source, columns):
+        validators = [self.model_cls._fields[i].validate if i != 'id' else int for i in columns]
+        for item in source:
+            if isinstance(item, Model):
+                values = [getattr(item, i) for i in columns]
+            elif isinstance(item, dict):
+                values = [item.get(i) for i in columns]
+            else:
+                values = list(item)
+                if len(values) != len(columns):
+                    raise IntegrityError("row {} doesn't match columns {}".format(item, ', '.join(columns)))
+
+            row = []
+            for field_name, validate, value in zip(columns, validators, values):
+                if value is None:
+                    if field_name != 'id' and self.model_cls._fields[field_name].required:
+                        raise IntegrityError('NOT NULL constraint failed: {} in {} column'.format(value, field_name))
+                    row.append(None)
+                else:
+                    row.append(validate(value))
+            yield row
+
 
-        print(insert_query.as_string(connection))
-        cursor.execute(insert_query.as_string(connection))
-        res = dict(zip([i.name for i in cursor.description], cursor.fetchone()))
-        connection.commit()
-        return self.model_cls(**res)
+class Page:
+    """Page of keyset pagination, cursor is opaque token of the next page or None on the last one"""
+
+    def __init__(self, objects, cursor):
+        self.objects = objects
+        self.cursor = cursor
+
+    @property
+    def has_next(self):
+        return self.cursor is not None
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    @staticmethod
+    def encode_cursor(order, values):
+        values = [{'dt': i.isoformat()} if isinstance(i, datetime.datetime) else i for i in values]
+        data = json.dumps({'o': order, 'v': values}, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor, order):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+            values = [datetime.datetime.fromisoformat(i['dt']) if isinstance(i, dict) else i for i in data['v']]
+        except (ValueError, TypeError, KeyError):
+            raise ValueError("invalid pagination cursor")
+        if data.get('o') != order:
+            raise ValueError("pagination cursor was made for other ordering")
+        return values
+
+
+class DeferredLoader:
+    """Loads deferred field for all objects of one result set with single query"""
+
+    def __init__(self, model_cls, objs, using=None):
+        self.model_cls = model_cls
+        self.objs = objs
+        self.using = using
+
+    def load(self, field_name):
+        pending = {obj.id: obj for obj in self.objs if field_name in obj._deferred}
+        if not pending:
+            return
+
+        def compose():
+            return sql.SQL("SELECT id, {} FROM {} WHERE id = ANY(%s)").format(
+                sql.Identifier(field_name), sql.Identifier(str(self.model_cls._table_name).lower()))
+
+        with router.db_for_read(self.using).cursor() as cursor:
+            query = query_cache.compile(('deferred', self.model_cls, field_name), compose, cursor)
+            execute(cursor, query, [list(pending)], self.model_cls)
+            res = dict(cursor.fetchall())
+
+        field = self.model_cls._fields[field_name]
+        for obj_id, obj in pending.items():
+            obj._deferred.discard(field_name)
+            object.__setattr__(obj, field_name, field.validate(res.get(obj_id)))
+
+
+class CopyStream:
+    """File-like object that renders rows to COPY text format lazily while COPY reads it"""
+
+    _escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def _next_line(self):
+        return '\t'.join(['\\N' if i is None else str(i).translate(self._escapes)
+                          for i in next(self._rows)]) + '\n'
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            try:
+                line = self._next_line()
+            except StopIteration:
+                break
+            chunks.append(line)
+            length += len(line)
+
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        if not self._buffer:
+            try:
+                self._buffer = self._next_line()
+            except StopIteration:
+                return ''
+        return self.read(len(self._buffer) if size < 0 else min(size, len(self._buffer)))
 
 
 class Model(metaclass=ModelMeta):
+    __slots__ = ()
+
     def __init__(self, *_, **kwargs):
+        # unset slots would send every attribute assignment through __getattr__
+        object.__setattr__(self, '_loaded', False)
+        object.__setattr__(self, '_changed', None)
+        object.__setattr__(self, '_deferred', frozenset())
+        object.__setattr__(self, '_related', None)
         setattr(self, 'id', kwargs.get('id'))
         for field_name, field in self._fields.items():
             value = field.validate(kwargs.get(field_name))
             setattr(self, field_name, value)
+        for relation_name in self._relations:
+            if kwargs.get(relation_name) is not None:
+                setattr(self, relation_name, kwargs[relation_name])
 
     objects = Manage()
+    _relations = {}
+    _deferred = frozenset()
+    _loaded = False
+    _changed = None
+    _related = None
+
+    @classmethod
+    def from_db(cls, **kwargs):
+        """Create object from database row, changes made after that are tracked"""
+        return cls.row_decoder(kwargs)(tuple(kwargs.values()))
+
+    @classmethod
+    def row_decoder(cls, names):
+        """Function making loaded object from row with given columns, values are trusted and not validated"""
+        names = tuple(names)
+        decoder = cls._decoders.get(names)
+        if decoder is None:
+            decoder = cls._decoders[names] = make_decoder(cls, names)
+        return decoder
+
+    def mark_saved(self):
+        object.__setattr__(self, '_loaded', True)
+        object.__setattr__(self, '_changed', None)
+
+    def __setattr__(self, name, value):
+        if name in self._fields and getattr(self, '_loaded', False):
+            changed = getattr(self, '_changed', None)
+            if changed is None:
+                changed = {}
+                object.__setattr__(self, '_changed', changed)
+            if name not in changed:
+                if name in getattr(self, '_deferred', ()):
+                    self._deferred.discard(name)
+                    changed[name] = _not_loaded
+                else:
+                    changed[name] = getattr(self, name)
+        object.__setattr__(self, name, value)
 
-    def check_fields(self):
+    def fields_to_update(self):
+        """Validate and return fields that save() would write to existing row"""
+        if getattr(self, '_loaded', False):
+            field_names = list((getattr(self, '_changed', None) or {}).keys())
+        else:
+            field_names = list(self._fields.keys())
+
+        for field_name in field_names:
+            object.__setattr__(self, field_name, self._fields[field_name].validate(getattr(self, field_name)))
+        if getattr(self, '_loaded', False):
+            field_names = self.changed_fields()
+        self.check_fields(field_names)
+        return field_names
+
+    def changed_fields(self):
+        """Names of fields whose values differ from the loaded ones"""
+        changed = getattr(self, '_changed', None) or {}
+        return [k for k, v in changed.items() if v is _not_loaded or getattr(self, k) != v]
+
+    def defer_fields(self, names, loader=None):
+        """Drop loaded values of fields, they are fetched again on first access"""
+        self._deferred = set(names)
+        self._deferred_loader = loader or DeferredLoader(type(self), [self])
+        for field_name in names:
+            delattr(self, field_name)
+
+    def load_deferred(self, field_name):
+        self._deferred_loader.load(field_name)
+        return getattr(self, field_name)
+
+    def __getattr__(self, name):
+        # unset slot of deferred field in slotted models
+        if name in getattr(type(self), '_fields', ()) and name in getattr(self, '_deferred', ()):
+            return self.load_deferred(name)
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+    def check_fields(self, field_names=None):
         """Return exception if required field is none"""
         for field_name, field in self._fields.items():
+            if field_names is not None and field_name not in field_names:
+                continue
             if (getattr(self, field_name) is None or getattr(self, field_name) == "None") and field.required:
                 raise IntegrityError(
                     'NOT NULL constraint failed: {} in {} column'.format(getattr(self, field_name),
@@ -469,18 +1815,106 @@ class Model(metaclass=ModelMeta):
         if self.id is None:
             raise DeleteError('{} object can\'t be deleted because its id attribute is set to None.'.
                               format(self._table_name))
+
+        session = current_unit_of_work()
+        if session is not None:
+            session.delete(self)
+            return
         try:
-            delete_query = sql.SQL("DELETE FROM {} WHERE id={}").format(sql.Identifier(str(self._table_name).lower()),
-                                                                        sql.Literal(self.id))
-            print(delete_query.as_string(connection))
-            cursor.execute(delete_query.as_string(connection))
-            connection.commit()
+            with pool.cursor() as cursor:
+                delete_query = query_cache.compile(
+                    ('delete_obj', type(self)),
+                    lambda: sql.SQL("DELETE FROM {} WHERE id=%s").format(sql.Identifier(str(self._table_name).lower())),
+                    cursor)
+                execute(cursor, delete_query, [self.id], type(self))
+                commit(cursor.connection)
+                _after_write(str(self._table_name).lower(), cursor.connection)
+            identity_map = current_identity_map()
+            if identity_map is not None:
+                identity_map.discard(type(self), self.id)
         except Exception:
             raise DeleteError('{} object can\'t be deleted because its id is incorrect.'.
                               format(self._table_name))
 
-    def save(self):
-        """Update if exists in db or create if not"""
+    def save(self, update_fields=None):
+        """Update if exists in db or create if not
+
+        Objects loaded from db update only changed fields, or update_fields if given.
+        Inside unit_of_work() object is only queued until flush."""
+        if self._queue_save(update_fields):
+            return
+
+        query = self._save_query(update_fields)
+        if query is None:
+            self.mark_saved()
+            return
+
+        key, compose, params = query
+        with pool.cursor() as cursor:
+            execute_prepared(cursor, key, query_cache.compile(key, compose, cursor), params, type(self))
+            if key[0] == 'save_insert':
+                self.id = cursor.fetchone()[0]
+            commit(cursor.connection)
+            _after_write(str(self._table_name).lower(), cursor.connection)
+        self._saved()
+
+    async def asave(self, update_fields=None):
+        """save() without blocking event loop"""
+        if self._queue_save(update_fields):
+            return
+
+        query = self._save_query(update_fields)
+        if query is None:
+            self.mark_saved()
+            return
+
+        key, compose, params = query
+        async with async_pool.connection() as conn:
+            cursor = await async_execute(conn, query_cache.compile(key, compose, conn), params, type(self))
+            if key[0] == 'save_insert':
+                self.id = cursor.fetchone()[0]
+        _after_write(str(self._table_name).lower())
+        self._saved()
+
+    def _queue_save(self, update_fields):
+        session = current_unit_of_work()
+        if session is not None:
+            if update_fields is not None:
+                raise ValueError("update_fields can't be used inside unit of work")
+            session.add(self)
+            return True
+        return False
+
+    def _save_query(self, update_fields):
+        """Validate fields and return cache key, compose function and params of UPDATE or INSERT
+
+        Returns None when loaded object has nothing to update."""
+        if getattr(self, 'id', None) is not None:
+            if update_fields is not None:
+                [Condition.check_fields((i, None), type(self)) for i in update_fields]
+                relations = self._relations
+                field_names = [relations[i].column if i in relations else i for i in update_fields if i != 'id']
+                for field_name in field_names:
+                    object.__setattr__(self, field_name,
+                                       self._fields[field_name].validate(getattr(self, field_name)))
+                self.check_fields(field_names)
+            else:
+                field_names = self.fields_to_update()
+
+            if not field_names:
+                return None
+
+            def compose():
+                return sql.SQL("UPDATE {} SET {} WHERE id=%s").format(
+                    sql.Identifier(str(self._table_name).lower()),
+                    sql.SQL(', ').join([sql.SQL("{}=%s").format(sql.Identifier(i)) for i in field_names]))
+
+            params = [*[getattr(self, i) for i in field_names], self.id]
+            return ('save_update', type(self), tuple(field_names)), compose, params
+
+        if update_fields is not None:
+            raise ValueError("update_fields can't be used to save object without id")
+
         for field_name, field in self._fields.items():
             value = field.validate(getattr(self, field_name))
             setattr(self, field_name, value)
@@ -488,42 +1922,21 @@ class Model(metaclass=ModelMeta):
         object_fields = ['id', *list(self._fields.keys())]
         self.check_fields()
 
-        if self.__dict__.get('id') is not None:
-            set_arr = []
-            for i in object_fields:
-                attr_value = getattr(self, i)
-
-                if attr_value is None:
-                    set_arr.append(sql.SQL("{}=null").format(sql.Identifier(i)))
-                else:
-                    set_arr.append(sql.SQL("{}={}").format(sql.Identifier(i), sql.Literal(attr_value)))
-
-            update_query = sql.SQL("UPDATE {} SET {} WHERE id={}").format(sql.Identifier(str(self._table_name).lower()),
-                                                                          sql.SQL(', ').join(set_arr),
-                                                                          sql.Literal(self.id))
-            print(update_query.as_string(connection))
-            cursor.execute(update_query.as_string(connection))
-            connection.commit()
-        else:
-            values = []
-            for i in object_fields:
-                if getattr(self, i) is not None:
-                    values.append(sql.SQL("{}").format(sql.Literal(getattr(self, i))))
-                else:
-                    if i == 'id':
-                        values.append(sql.SQL('DEFAULT'))
-                    else:
-                        values.append(sql.SQL("null"))
-
-            insert_query = sql.SQL("INSERT INTO {0} ({1}) VALUES ({2}) RETURNING id;").format(
+        def compose():
+            return sql.SQL("INSERT INTO {0} ({1}) VALUES (DEFAULT, {2}) RETURNING id;").format(
                 sql.Identifier(str(self._table_name).lower()),
                 sql.SQL(', ').join([sql.Identifier(i) for i in object_fields]),
-                sql.SQL(', ').join(values))
+                sql.SQL(', ').join([sql.Placeholder()] * (len(object_fields) - 1)))
+
+        params = [getattr(self, i) for i in object_fields[1:]]
+        return ('save_insert', type(self)), compose, params
+
+    def _saved(self):
+        self.mark_saved()
 
-            print(insert_query.as_string(connection))
-            cursor.execute(insert_query.as_string(connection))
-            self.id = cursor.fetchone()[0]
-            connection.commit()
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            identity_map.add(self, replace=True)
 
     class Meta:
         table_name = ''
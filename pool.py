@@ -0,0 +1,315 @@
+import os
+import threading
+import time
+import weakref
+import psycopg2
+from collections import OrderedDict
+from contextlib import contextmanager
+from psycopg2 import extensions
+from exceptions import PoolError
+
+_pools = weakref.WeakSet()
+
+
+def _after_fork():
+    for pool in list(_pools):
+        pool.after_fork()
+
+
+def detach_inherited(connections):
+    """Point sockets of connections inherited from parent process to /dev/null
+
+    Deallocated connection sends Terminate message, on socket shared with parent
+    it would end parent's session. After this it goes nowhere."""
+    devnull = os.open(os.devnull, os.O_RDWR)
+    try:
+        for conn in connections:
+            try:
+                os.dup2(devnull, conn.fileno())
+            except (OSError, psycopg2.Error):
+                # already closed
+                pass
+    finally:
+        os.close(devnull)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class Connection(extensions.connection):
+    """Connection that remembers server-side prepared statements created on it and its own query hooks"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = OrderedDict()
+        self.savepoints = []
+        self.touched = set()
+        self.hooks = []
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections in autocommit mode
+
+    Every thread gets its own connection for as long as it holds one,
+    nested checkouts in the same thread reuse it. Lazy pool opens its
+    first connections on the first checkout instead of in constructor.
+    Autocommit saves ROLLBACK of every read, transactions are opened by atomic()."""
+
+    def __init__(self, minconn=1, maxconn=10, timeout=30, max_age=3600, check_interval=30, lazy=False,
+                 **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("pool size must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.connect_kwargs = connect_kwargs
+        self.connect_kwargs.setdefault('connection_factory', Connection)
+
+        self._lock = threading.Condition()
+        self._idle = []
+        self._created = {}
+        self._connections = {}
+        self._used = 0
+        self._pending = 0
+        self._local = threading.local()
+        self._configured = time.monotonic()
+        self._inherited = []
+        self._filled = False
+        self.closed = False
+        _pools.add(self)
+
+        if not lazy:
+            self._fill()
+
+    def _fill(self):
+        """Open connections up to minconn, slots are claimed under lock and connected outside it"""
+        with self._lock:
+            self._filled = True
+            missing = max(0, self.minconn - len(self._created) - self._pending)
+            self._pending += missing
+        for _ in range(missing):
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+                self._lock.notify()
+
+    def configure(self, minconn=None, maxconn=None, timeout=None, max_age=None, **connect_kwargs):
+        """Change pool settings and connection parameters
+
+        Idle connections are closed, ones in use are closed when they are given back."""
+        with self._lock:
+            self.minconn = self.minconn if minconn is None else minconn
+            self.maxconn = self.maxconn if maxconn is None else maxconn
+            self.timeout = self.timeout if timeout is None else timeout
+            self.max_age = self.max_age if max_age is None else max_age
+            if self.minconn < 0 or self.maxconn < 1 or self.minconn > self.maxconn:
+                raise ValueError("pool size must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+            self.connect_kwargs.update(connect_kwargs)
+
+            self._configured = time.monotonic()
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+            self._filled = False
+            self._lock.notify_all()
+
+    def after_fork(self):
+        """Forget connections inherited from parent process
+
+        Their sockets are shared with parent, so they are detached from them
+        before anything can close them, and never used again."""
+        detach_inherited(self._connections.values())
+        self._inherited.extend(self._connections.values())
+        self._lock = threading.Condition()
+        self._idle = []
+        self._created = {}
+        self._connections = {}
+        self._used = 0
+        self._pending = 0
+        self._local = threading.local()
+        self._filled = False
+
+    def _connect(self):
+        """Open connection for slot claimed with _pending, called without lock"""
+        try:
+            conn = psycopg2.connect(**self.connect_kwargs)
+            conn.autocommit = True
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._pending -= 1
+            self._created[id(conn)] = time.monotonic()
+            self._connections[id(conn)] = conn
+        return conn
+
+    def _forget(self, conn):
+        """Remove connection from pool under lock, return False if it isn't pool's connection"""
+        self._created.pop(id(conn), None)
+        # None for already discarded connection or one inherited from parent process
+        return self._connections.pop(id(conn), None) is not None
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _discard(self, conn):
+        if self._forget(conn):
+            self._close(conn)
+
+    def _expired(self, conn):
+        created = self._created.get(id(conn), 0)
+        if created < self._configured:
+            return True
+        return self.max_age is not None and time.monotonic() - created > self.max_age
+
+    def _healthy(self, conn, idle_since):
+        """Return False if connection is closed, broken or too old"""
+        if conn.closed or self._expired(conn):
+            return False
+        if self.check_interval is not None and time.monotonic() - idle_since > self.check_interval:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _claim(self, deadline):
+        """Take idle connection or free slot under lock, return (conn, idle_since), conn is None for slot"""
+        with self._lock:
+            while True:
+                if self.closed:
+                    raise PoolError("connection pool is closed")
+                if self._idle:
+                    self._used += 1
+                    return self._idle.pop()
+                if len(self._created) + self._pending < self.maxconn:
+                    self._used += 1
+                    self._pending += 1
+                    return None, None
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolError("couldn't get connection in {} seconds, pool is exhausted ({} connections)".
+                                    format(self.timeout, self.maxconn))
+                self._lock.wait(remaining)
+
+    def _acquire(self):
+        """Connect and health check run outside the lock, so other threads aren't blocked by network"""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        if not self._filled:
+            self._fill()
+        while True:
+            conn, idle_since = self._claim(deadline)
+            if conn is None:
+                try:
+                    return self._connect()
+                except BaseException:
+                    with self._lock:
+                        self._used -= 1
+                    raise
+            if self._healthy(conn, idle_since):
+                return conn
+
+            with self._lock:
+                self._used -= 1
+                forgotten = self._forget(conn)
+                self._lock.notify()
+            if forgotten:
+                self._close(conn)
+
+    def _release(self, conn):
+        broken = False
+        if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if not broken and not conn.closed and not conn.autocommit:
+            # left in manual mode by named cursor or broken atomic block
+            conn.autocommit = True
+
+        forgotten = False
+        with self._lock:
+            self._used -= 1
+            if broken or conn.closed or self.closed or self._expired(conn) or len(self._idle) >= self.maxconn:
+                forgotten = self._forget(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+        if forgotten:
+            self._close(conn)
+
+    def current(self):
+        """Connection held by the current thread or None"""
+        holder = getattr(self._local, 'holder', None)
+        return holder[0] if holder is not None else None
+
+    def getconn(self):
+        """Get connection bound to the current thread"""
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            holder = self._local.holder = [self._acquire(), 0]
+        holder[1] += 1
+        return holder[0]
+
+    def putconn(self, conn):
+        """Give connection back, it returns to the pool after the outermost putconn"""
+        holder = getattr(self._local, 'holder', None)
+        if holder is None or holder[0] is not conn:
+            if any(conn is i for i in self._inherited):
+                # checked out before fork, parent process gives it back
+                return
+            raise PoolError("connection doesn't belong to the current thread")
+        holder[1] -= 1
+        if holder[1] == 0:
+            self._local.holder = None
+            self._release(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    @contextmanager
+    def detached(self):
+        """Connection not bound to the thread, commits made by other queries don't touch it"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def cursor(self):
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                yield cur
+
+    def closeall(self):
+        with self._lock:
+            self.closed = True
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+            self._lock.notify_all()
+
+    @property
+    def size(self):
+        return len(self._created)
+
+    @property
+    def used(self):
+        return self._used
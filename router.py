@@ -0,0 +1,63 @@
+import contextvars
+import itertools
+import time
+from transaction import in_atomic
+
+_last_write = contextvars.ContextVar('orm_last_write', default=None)
+
+
+class Router:
+    """Chooses connection pool for query
+
+    Writes, reads inside atomic blocks and reads shortly after a write of the
+    same thread or task go to primary, other reads go to replicas."""
+
+    strategies = ('round_robin', 'least_load')
+
+    def __init__(self, primary, replicas=None, strategy='round_robin', read_your_writes=1.0):
+        self.primary = primary
+        self.configure(replicas, strategy, read_your_writes)
+
+    def configure(self, replicas=None, strategy='round_robin', read_your_writes=1.0):
+        """Set replica pools, replicas are list of pools or dict of them by name"""
+        if strategy not in self.strategies:
+            raise ValueError("strategy can be only {}".format(' or '.join(self.strategies)))
+        if isinstance(replicas, dict):
+            self.replicas = dict(replicas)
+        else:
+            self.replicas = {'replica{}'.format(n): i for n, i in enumerate(replicas or ())}
+        self.strategy = strategy
+        self.read_your_writes = read_your_writes
+        self._counter = itertools.count()
+
+    def record_write(self):
+        """Send reads of current thread or task to primary for read_your_writes seconds"""
+        if self.replicas:
+            _last_write.set(time.monotonic())
+
+    def _pinned(self):
+        current = self.primary.current()
+        if current is not None and in_atomic(current):
+            return True
+        last_write = _last_write.get()
+        return last_write is not None and time.monotonic() - last_write < self.read_your_writes
+
+    def db_for_read(self, using=None):
+        if using == 'primary' or not self.replicas:
+            return self.primary
+        if using is not None and using != 'replica':
+            try:
+                return self.replicas[using]
+            except KeyError:
+                raise ValueError("unknown database '{}', choices are: primary, replica, {}".
+                                 format(using, ', '.join(self.replicas)))
+        if using is None and self._pinned():
+            return self.primary
+
+        replicas = list(self.replicas.values())
+        if self.strategy == 'least_load':
+            return min(replicas, key=lambda i: i.used)
+        return replicas[next(self._counter) % len(replicas)]
+
+    def db_for_write(self):
+        return self.primary
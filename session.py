@@ -0,0 +1,107 @@
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from transaction import atomic
+
+_current_session = contextvars.ContextVar('unit_of_work', default=None)
+
+
+def _snapshot(obj):
+    changed = getattr(obj, '_changed', None)
+    return obj, obj.id, getattr(obj, '_loaded', False), None if changed is None else dict(changed)
+
+
+def _restore(obj, obj_id, loaded, changed):
+    """Put back id and dirty state of object saved by a rolled back flush"""
+    object.__setattr__(obj, 'id', obj_id)
+    object.__setattr__(obj, '_loaded', loaded)
+    object.__setattr__(obj, '_changed', changed)
+
+
+class UnitOfWork:
+    """Queues saves and deletes and writes them grouped by model and operation on flush"""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self._new = OrderedDict()
+        self._dirty = OrderedDict()
+        self._deleted = OrderedDict()
+
+    def add(self, obj):
+        if obj.id is None:
+            self._new[id(obj)] = obj
+        else:
+            self._deleted.pop((type(obj), obj.id), None)
+            self._dirty[(type(obj), obj.id)] = obj
+
+    def delete(self, obj):
+        self._dirty.pop((type(obj), obj.id), None)
+        self._deleted[(type(obj), obj.id)] = obj
+
+    def __len__(self):
+        return len(self._new) + len(self._dirty) + len(self._deleted)
+
+    def flush(self):
+        """Send queued changes: multi-row INSERT, UPDATE ... FROM (VALUES ...) and DELETE ... = ANY(...)"""
+        new, dirty, deleted = self._new, self._dirty, self._deleted
+        self._new, self._dirty, self._deleted = OrderedDict(), OrderedDict(), OrderedDict()
+        if not (new or dirty or deleted):
+            return
+
+        # ids and dirty state are set while flushing, transaction rollback must undo them too
+        snapshots = [_snapshot(obj) for obj in [*new.values(), *dirty.values()]]
+
+        # queue is off while flushing, model methods write directly
+        token = _current_session.set(None)
+        try:
+            with atomic():
+                inserts = OrderedDict()
+                for obj in new.values():
+                    inserts.setdefault(type(obj), []).append(obj)
+                for model_cls, objs in inserts.items():
+                    model_cls.objects.bulk_create(objs, batch_size=self.batch_size)
+
+                updates = OrderedDict()
+                for obj in dirty.values():
+                    field_names = obj.fields_to_update()
+                    if field_names:
+                        updates.setdefault((type(obj), tuple(field_names)), []).append(obj)
+                    else:
+                        obj.mark_saved()
+                for (model_cls, field_names), objs in updates.items():
+                    model_cls.objects._update_objects(objs, list(field_names), batch_size=self.batch_size)
+                    for obj in objs:
+                        obj.mark_saved()
+
+                deletes = OrderedDict()
+                for model_cls, obj_id in deleted:
+                    deletes.setdefault(model_cls, []).append(obj_id)
+                for model_cls, ids in deletes.items():
+                    model_cls.objects._delete_ids(ids)
+        except Exception:
+            # keep changes queued, so they can be fixed and flushed again
+            for snapshot in snapshots:
+                _restore(*snapshot)
+            new.update(self._new)
+            dirty.update(self._dirty)
+            deleted.update(self._deleted)
+            self._new, self._dirty, self._deleted = new, dirty, deleted
+            raise
+        finally:
+            _current_session.reset(token)
+
+
+def current_unit_of_work():
+    return _current_session.get()
+
+
+@contextmanager
+def unit_of_work(batch_size=1000):
+    """Queue Model.save() and Model.delete() inside the block, flush them on exit"""
+    session = UnitOfWork(batch_size)
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+    session.flush()
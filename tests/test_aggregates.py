@@ -0,0 +1,39 @@
+import unittest
+from aggregates import Count
+from exceptions import LookupError
+from my_models import User
+from tests.test_pagination import render
+
+
+class GroupByTestCase(unittest.TestCase):
+    def test_group_by_needs_annotations(self):
+        with self.assertRaises(TypeError):
+            User.objects.all().group_by('age')._select_query()
+
+    def test_grouping_is_part_of_shape(self):
+        # plain select compiled earlier must not be reused for grouped queryset
+        self.assertNotEqual(User.objects.all().group_by('age').annotation_shape(),
+                            User.objects.all().annotation_shape())
+        self.assertNotEqual(User.objects.all().group_by('age').annotate(n=Count()).annotation_shape(),
+                            User.objects.all().group_by('name').annotate(n=Count()).annotation_shape())
+
+
+class GroupedValuesTestCase(unittest.TestCase):
+    def grouped(self):
+        return User.objects.all().group_by('age').annotate(n=Count())
+
+    def test_default_columns(self):
+        self.assertEqual(self.grouped()._value_columns(()), ['age', 'n'])
+
+    def test_selects_exactly_requested_names(self):
+        qs = self.grouped()
+        self.assertEqual(render(qs._select_query(qs._value_columns(('n',)))),
+                         'SELECT "n" FROM (SELECT "age", count(*) AS "n" FROM "ormtable" GROUP BY "age") AS tmp_table')
+
+    def test_unknown_name(self):
+        with self.assertRaises(LookupError):
+            self.grouped()._value_columns(('name',))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+from unittest import mock
+from aio import AsyncConnectionPool
+
+
+class FakeConnection:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+def connect(async_=False, **kwargs):
+    kwargs.pop('connection_factory', None)
+    return FakeConnection(**kwargs)
+
+
+async def ready(conn):
+    pass
+
+
+@mock.patch('aio.wait', side_effect=ready)
+@mock.patch('aio.psycopg2.connect', side_effect=connect)
+class AsyncConnectionPoolTestCase(unittest.TestCase):
+    def test_configure_closes_connections_in_use_on_release(self, connect_mock, wait_mock):
+        async def main():
+            pool = AsyncConnectionPool(maxconn=2, host='a')
+            used, idle = await pool.acquire(), await pool.acquire()
+            pool.release(idle)
+            pool.configure(host='b')
+            self.assertEqual((idle.closed, pool.size), (1, 1))
+
+            pool.release(used)
+            self.assertEqual((used.closed, pool.size), (1, 0))
+            async with pool.connection() as conn:
+                self.assertEqual(conn.kwargs['host'], 'b')
+            self.assertEqual((conn.closed, pool.size), (0, 1))
+        asyncio.run(main())
+
+    def test_connection_of_parent_process_is_ignored(self, connect_mock, wait_mock):
+        async def main():
+            pool = AsyncConnectionPool(maxconn=1)
+            conn = await pool.acquire()
+            with mock.patch('aio.detach_inherited') as detach:
+                pool.after_fork()
+                pool.release(conn)
+            detach.assert_called_with([conn])
+            self.assertEqual((conn.closed, pool.size), (0, 0))
+        asyncio.run(main())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from unittest import mock
+import cache
+from cache import LRUCache, cache_key, set_result_cache, get_result_cache, invalidate_table
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_get_and_set(self):
+        results = LRUCache()
+        self.assertIsNone(results.get('a'))
+        results.set('a', [1, 2])
+        self.assertEqual(results.get('a'), [1, 2])
+
+    @mock.patch('cache.time.monotonic')
+    def test_ttl(self, monotonic):
+        monotonic.return_value = 100
+        results = LRUCache(ttl=10)
+        results.set('default', 1)
+        results.set('own', 2, ttl=30)
+        monotonic.return_value = 120
+        self.assertIsNone(results.get('default'))
+        self.assertEqual(results.get('own'), 2)
+        monotonic.return_value = 140
+        self.assertIsNone(results.get('own'))
+        self.assertEqual(len(results), 0)
+
+    @mock.patch('cache.time.monotonic')
+    def test_no_ttl(self, monotonic):
+        monotonic.return_value = 100
+        results = LRUCache(ttl=None)
+        results.set('a', 1)
+        monotonic.return_value = 10 ** 6
+        self.assertEqual(results.get('a'), 1)
+
+    def test_least_recently_used_is_evicted(self):
+        results = LRUCache(maxsize=2)
+        results.set('a', 1)
+        results.set('b', 2)
+        results.get('a')
+        results.set('c', 3)
+        self.assertIsNone(results.get('b'))
+        self.assertEqual((results.get('a'), results.get('c')), (1, 3))
+
+    def test_invalidate_by_table(self):
+        results = LRUCache()
+        results.set('users', 1, tables=['user'])
+        results.set('join', 2, tables=['user', 'book'])
+        results.set('books', 3, tables=['book'])
+        results.invalidate('user')
+        self.assertIsNone(results.get('users'))
+        self.assertIsNone(results.get('join'))
+        self.assertEqual(results.get('books'), 3)
+        results.invalidate('book')
+        self.assertEqual((len(results), results._tables), (0, {}))
+
+    def test_set_replaces_tables(self):
+        results = LRUCache()
+        results.set('a', 1, tables=['user'])
+        results.set('a', 2, tables=['book'])
+        results.invalidate('user')
+        self.assertEqual(results.get('a'), 2)
+
+    def test_evicted_entry_leaves_table_index(self):
+        results = LRUCache(maxsize=1)
+        results.set('a', 1, tables=['user'])
+        results.set('b', 2, tables=['book'])
+        self.assertNotIn('user', results._tables)
+
+    def test_maxsize(self):
+        with self.assertRaises(ValueError):
+            LRUCache(maxsize=0)
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def tearDown(self):
+        set_result_cache(None)
+
+    def test_backend(self):
+        with self.assertRaises(TypeError):
+            set_result_cache({})
+        results = LRUCache()
+        set_result_cache(results)
+        self.assertIs(get_result_cache(), results)
+        results.set('a', 1, tables=['user'])
+        invalidate_table('user')
+        self.assertIsNone(results.get('a'))
+
+    def test_invalidate_without_backend(self):
+        self.assertIsNone(cache._result_cache)
+        invalidate_table('user')
+
+    def test_key_includes_params(self):
+        self.assertNotEqual(cache_key('SELECT %s', [1]), cache_key('SELECT %s', ['1']))
+        self.assertEqual(cache_key('SELECT %s', (1,)), cache_key('SELECT %s', [1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
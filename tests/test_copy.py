@@ -0,0 +1,46 @@
+import unittest
+from model import CopyStream
+
+
+class CopyStreamTestCase(unittest.TestCase):
+    def test_escaping(self):
+        stream = CopyStream([('a\tb', 'c\nd', 'back\\slash', 'cr\r'), (None, 1, 2.5, True)])
+        self.assertEqual(stream.read(), 'a\\tb\tc\\nd\tback\\\\slash\tcr\\r\n\\N\t1\t2.5\tTrue\n')
+
+    def test_null_and_empty_string_differ(self):
+        self.assertEqual(CopyStream([(None, '')]).read(), '\\N\t\n')
+
+    def test_read_in_chunks(self):
+        rows = [(i, 'name {}'.format(i)) for i in range(100)]
+        expected = CopyStream(rows).read()
+        stream = CopyStream(rows)
+        chunks = []
+        while True:
+            chunk = stream.read(7)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 7)
+            chunks.append(chunk)
+        self.assertEqual(''.join(chunks), expected)
+
+    def test_rows_are_rendered_lazily(self):
+        rendered = []
+
+        def rows():
+            for i in range(3):
+                rendered.append(i)
+                yield (i,)
+        stream = CopyStream(rows())
+        self.assertEqual(stream.read(2), '0\n')
+        self.assertEqual(rendered, [0])
+
+    def test_readline(self):
+        stream = CopyStream([(1, 'a'), (2, 'b')])
+        self.assertEqual(stream.readline(), '1\ta\n')
+        self.assertEqual(stream.readline(2), '2\t')
+        self.assertEqual(stream.readline(), 'b\n')
+        self.assertEqual(stream.readline(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import logging
+import unittest
+from unittest import mock
+import hooks
+from hooks import QueryEvent, add_hook, remove_hook, run, execute, LatencyHistogram, SlowQueryLog
+
+
+class FakeConnection:
+    def __init__(self):
+        self.hooks = []
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 1
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+
+def event(sql='SELECT 1', duration=0.0):
+    return QueryEvent(sql, None, duration, 0, None, None)
+
+
+class RunTestCase(unittest.TestCase):
+    def hook(self, connection=None):
+        events = []
+        add_hook(events.append, connection)
+        self.addCleanup(remove_hook, events.append, connection)
+        return events
+
+    @mock.patch('hooks.time.perf_counter')
+    def test_plain_call_without_hooks(self, perf_counter):
+        cursor = FakeCursor(FakeConnection())
+        func = mock.Mock(return_value='res')
+        self.assertEqual(run(cursor, 'SELECT 1', None, None, func, 1, b=2), 'res')
+        func.assert_called_once_with(1, b=2)
+        perf_counter.assert_not_called()
+
+    def test_global_hook(self):
+        events = self.hook()
+        first, second = FakeCursor(FakeConnection()), FakeCursor(FakeConnection())
+        execute(first, b'SELECT 1', [1], 'model')
+        execute(second, 'SELECT 2')
+        self.assertEqual([(i.sql, i.params, i.model, i.rowcount) for i in events],
+                         [('SELECT 1', [1], 'model', 1), ('SELECT 2', None, None, 1)])
+        self.assertEqual(first.executed, [(b'SELECT 1', [1])])
+
+    def test_connection_hook(self):
+        conn = FakeConnection()
+        events = self.hook(conn)
+        execute(FakeCursor(FakeConnection()), 'SELECT 1')
+        execute(FakeCursor(conn), 'SELECT 2')
+        self.assertEqual([i.sql for i in events], ['SELECT 2'])
+        self.assertIs(events[0].connection, conn)
+
+    def test_add_is_idempotent_and_remove(self):
+        events = self.hook()
+        add_hook(events.append)
+        execute(FakeCursor(FakeConnection()), 'SELECT 1')
+        self.assertEqual(len(events), 1)
+        remove_hook(events.append)
+        remove_hook(events.append)
+        self.assertEqual(hooks._hooks, [])
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+    def test_percentile_is_upper_bound_of_bucket(self):
+        histogram = LatencyHistogram(buckets=(1, 0.1, 0.01))
+        for duration in (0.005, 0.01, 0.05, 0.5):
+            histogram(event(duration=duration))
+        self.assertEqual([histogram.percentile('SELECT 1', p) for p in (25, 50, 75, 100)], [0.01, 0.01, 0.1, 1])
+
+    def test_slower_than_last_bucket(self):
+        histogram = LatencyHistogram(buckets=(0.1,))
+        histogram(event(duration=0.05))
+        histogram(event(duration=3.0))
+        self.assertEqual(histogram.percentile('SELECT 1', 100), 3.0)
+
+    def test_shapes_are_separate(self):
+        histogram = LatencyHistogram()
+        histogram(event('SELECT 1', 0.2))
+        histogram(event('SELECT 2', 0.3))
+        self.assertIsNone(histogram.percentile('SELECT 3', 50))
+        snapshot = histogram.snapshot()
+        self.assertEqual({k: (v['count'], v['max']) for k, v in snapshot.items()},
+                         {'SELECT 1': (1, 0.2), 'SELECT 2': (1, 0.3)})
+        snapshot['SELECT 1']['buckets'][0] = 100
+        self.assertNotEqual(histogram.snapshot()['SELECT 1']['buckets'][0], 100)
+        histogram.reset()
+        self.assertEqual(histogram.snapshot(), {})
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+    def test_threshold(self):
+        log = mock.Mock()
+        hook = SlowQueryLog(threshold=0.5, log=log, level=logging.ERROR)
+        hook(event(duration=0.49))
+        log.log.assert_not_called()
+        hook(event(duration=0.5))
+        self.assertEqual(log.log.call_count, 1)
+        self.assertEqual(log.log.call_args[0][0], logging.ERROR)
+
+
+if __name__ == '__main__':
+    unittest.main()
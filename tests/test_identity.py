@@ -0,0 +1,72 @@
+import unittest
+from identity import IdentityMap, identity_map, current_identity_map
+from my_models import User, Man
+
+
+def user(model_cls, obj_id):
+    obj = model_cls(name='user {}'.format(obj_id))
+    obj.id = obj_id
+    return obj
+
+
+class IdentityMapTestCase(unittest.TestCase):
+    def test_one_object_per_row(self):
+        objects = IdentityMap()
+        first = user(User, 1)
+        self.assertIs(objects.add(first), first)
+        self.assertIs(objects.add(user(User, 1)), first)
+        self.assertIs(objects.get(User, 1), first)
+        self.assertEqual(len(objects), 1)
+
+    def test_replace(self):
+        objects = IdentityMap()
+        objects.add(user(User, 1))
+        second = user(User, 1)
+        self.assertIs(objects.add(second, replace=True), second)
+        self.assertIs(objects.get(User, 1), second)
+
+    def test_models_are_separate(self):
+        objects = IdentityMap()
+        objects.add(user(User, 1))
+        man = objects.add(user(Man, 1))
+        self.assertIs(objects.get(Man, 1), man)
+        self.assertIsNot(objects.get(User, 1), man)
+
+    def test_least_recently_used_is_evicted(self):
+        objects = IdentityMap(maxsize=2)
+        objects.add(user(User, 1))
+        objects.add(user(User, 2))
+        objects.get(User, 1)
+        objects.add(user(User, 3))
+        self.assertIsNone(objects.get(User, 2))
+        self.assertIsNotNone(objects.get(User, 1))
+        self.assertEqual(len(objects), 2)
+
+    def test_discard(self):
+        objects = IdentityMap()
+        for i in range(3):
+            objects.add(user(User, i))
+        objects.add(user(Man, 1))
+        objects.discard(User, 0)
+        self.assertIsNone(objects.get(User, 0))
+        objects.discard_model(User)
+        self.assertEqual(len(objects), 1)
+        objects.clear()
+        self.assertEqual(len(objects), 0)
+
+    def test_maxsize(self):
+        with self.assertRaises(ValueError):
+            IdentityMap(maxsize=0)
+
+    def test_context(self):
+        self.assertIsNone(current_identity_map())
+        with identity_map(10) as objects:
+            self.assertIs(current_identity_map(), objects)
+            with identity_map() as inner:
+                self.assertIs(current_identity_map(), inner)
+            self.assertIs(current_identity_map(), objects)
+        self.assertIsNone(current_identity_map())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+from model import Model
+from fields import StringField, IntField, ForeignKeyField
+
+
+class Base(Model):
+    name = StringField()
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('name', 'default')
+        super().__init__(*args, **kwargs)
+
+    class Meta:
+        table_name = 'base'
+
+
+class Child(Base):
+    age = IntField()
+
+    class Meta:
+        table_name = 'child'
+
+
+class Plain(Model):
+    name = StringField()
+
+    class Meta:
+        table_name = 'plain'
+
+
+class PlainChild(Plain):
+    age = IntField()
+
+    class Meta:
+        table_name = 'plain_child'
+
+
+class CustomChild(Plain):
+    age = IntField()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    class Meta:
+        table_name = 'custom_child'
+
+
+class Slotted(Model):
+    name = StringField()
+
+    class Meta:
+        table_name = 'slotted'
+        slots = True
+
+
+class SlottedChild(Slotted):
+    age = IntField()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    class Meta:
+        table_name = 'slotted_child'
+        slots = True
+
+
+class Author(Model):
+    name = StringField()
+
+    class Meta:
+        table_name = 'author'
+
+
+class Book(Model):
+    title = StringField()
+    author = ForeignKeyField(Author)
+
+    class Meta:
+        table_name = 'book'
+
+
+class InitTestCase(unittest.TestCase):
+    def test_inherited_custom_init_is_kept(self):
+        self.assertEqual(Child().name, 'default')
+        self.assertEqual(Child(age=3).age, 3)
+
+    def test_generated_init(self):
+        self.assertTrue(getattr(Plain.__init__, '_generated', False))
+        self.assertIsNot(PlainChild.__init__, Plain.__init__)
+        obj = PlainChild(name='a', age='4')
+        self.assertEqual((obj.name, obj.age, obj.id), ('a', 4, None))
+
+    def test_custom_init_calling_generated_one(self):
+        # generated init of parent doesn't know age, child must still get it
+        obj = CustomChild(name='x', age='3')
+        self.assertEqual((obj.name, obj.age, obj.id), ('x', 3, None))
+        self.assertEqual(CustomChild().age, None)
+
+    def test_tracking_state_is_set(self):
+        # read without __getattr__ fallback, unset slot raises AttributeError
+        for obj in (Slotted(name='a'), SlottedChild(name='a', age=1), Slotted.row_decoder(['id', 'name'])((1, 'a'))):
+            with self.subTest(model=type(obj).__name__):
+                self.assertIsInstance(object.__getattribute__(obj, '_loaded'), bool)
+                self.assertIsNone(object.__getattribute__(obj, '_changed'))
+                self.assertEqual(object.__getattribute__(obj, '_deferred'), frozenset())
+
+
+class RelationTestCase(unittest.TestCase):
+    def test_related_object_sets_id_column(self):
+        author = Author(id=3, name='a')
+        book = Book(title='t', author=author)
+        self.assertEqual(book.author_id, 3)
+        self.assertIs(book.author, author)
+
+    def test_save_update_fields_with_relation_name(self):
+        book = Book.row_decoder(['id', 'title', 'author_id'])((5, 't', None))
+        book.author = Author(id=3, name='a')
+        key, compose, params = book._save_query(['author'])
+        self.assertEqual((key, params), (('save_update', Book, ('author_id',)), [3, 5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import datetime
+import functools
+import itertools
+import unittest
+from psycopg2 import sql
+from model import QuerySet, Page
+from my_models import User
+
+
+def render(composable):
+    """SQL text of composed query without connection, identifiers are always quoted"""
+    if isinstance(composable, sql.Composed):
+        return ''.join(render(i) for i in composable)
+    if isinstance(composable, sql.Identifier):
+        return '.'.join('"{}"'.format(i) for i in composable.strings)
+    if isinstance(composable, sql.Placeholder):
+        return '%s'
+    return composable.string
+
+
+def matches(terms, row):
+    """Evaluate seek terms of QuerySet._seek_terms() on row dict like Postgres would"""
+    ops = {'=': lambda v, x: v is not None and v == x,
+           'is null': lambda v, x: v is None,
+           'is not null': lambda v, x: v is not None,
+           '>': lambda v, x: v is not None and v > x,
+           '< or null': lambda v, x: v is None or v < x}
+    return any(all(ops[op](row[column], value) for column, op, value in term) for term in terms)
+
+
+def postgres_order(order):
+    """Sort key of rows ordered like format_order_list: ASC NULLS FIRST, DESC NULLS LAST"""
+    def compare(a, b):
+        for i in order:
+            column, desc = i.strip('-'), i.startswith('-')
+            x, y = a[column], b[column]
+            if x == y:
+                continue
+            if x is None or y is None:
+                # NULLS FIRST for ascending columns, NULLS LAST for descending ones
+                res = -1 if x is None else 1
+                return res if not desc else -res
+            res = -1 if x < y else 1
+            return -res if desc else res
+        return 0
+    return functools.cmp_to_key(compare)
+
+
+class SeekTestCase(unittest.TestCase):
+    rows = [{'age': age, 'name': name, 'id': n}
+            for n, (age, name) in enumerate(itertools.product([None, 1, 2], [None, 'a', 'b']), 1)]
+
+    def seek(self, order, values):
+        qs = QuerySet(User, None, None, list(order))
+        qs.seek = (list(order), list(values))
+        return qs
+
+    def test_terms_select_rows_after_cursor(self):
+        for order in (['age', 'id'], ['-age', 'id'], ['age', '-name', 'id'], ['-age', '-name', 'id'],
+                      ['name', 'age', 'id']):
+            ordered = sorted(self.rows, key=postgres_order(order))
+            for n, cursor in enumerate(ordered):
+                qs = self.seek(order, [cursor[i.strip('-')] for i in order])
+                with self.subTest(order=order, cursor=cursor):
+                    self.assertEqual([i for i in ordered if matches(qs._seek_terms(), i)], ordered[n + 1:])
+
+    def test_row_comparison_for_ascending_values(self):
+        qs = self.seek(['age', 'id'], [3, 10])
+        self.assertTrue(qs._seek_by_row())
+        self.assertEqual(render(qs.format_seek()), '("age", "id") > (%s, %s)')
+        self.assertEqual(qs.seek_params(), [3, 10])
+
+    def test_no_row_comparison_with_null_or_descending(self):
+        for order, values in ((['age', 'id'], [None, 10]), (['-age', 'id'], [3, 10])):
+            with self.subTest(order=order, values=values):
+                self.assertFalse(self.seek(order, values)._seek_by_row())
+
+    def test_mixed_directions(self):
+        qs = self.seek(['-age', 'id'], [3, 10])
+        self.assertEqual(render(qs.format_seek()),
+                         '((("age" < %s OR "age" IS NULL)) OR ("age"=%s AND "id" > %s))')
+        self.assertEqual(qs.seek_params(), [3, 3, 10])
+
+    def test_null_values(self):
+        qs = self.seek(['age', 'id'], [None, 10])
+        self.assertEqual(render(qs.format_seek()), '(("age" IS NOT NULL) OR ("age" IS NULL AND "id" > %s))')
+        self.assertEqual(qs.seek_params(), [10])
+
+    def test_last_descending_null_selects_nothing(self):
+        qs = self.seek(['-age'], [None])
+        self.assertEqual(render(qs.format_seek()), 'FALSE')
+        self.assertEqual(qs.seek_params(), [])
+
+    def test_params_match_placeholders(self):
+        for order in (['age', '-name', 'id'], ['-age', '-name', 'id']):
+            for values in itertools.product([None, 1], [None, 'a'], [5]):
+                qs = self.seek(order, values)
+                with self.subTest(order=order, values=values):
+                    self.assertEqual(render(qs.format_seek()).count('%s'), len(qs.seek_params()))
+
+    def test_shape_depends_on_nulls(self):
+        self.assertNotEqual(self.seek(['age', 'id'], [None, 1]).seek_shape(),
+                            self.seek(['age', 'id'], [2, 1]).seek_shape())
+        self.assertEqual(self.seek(['age', 'id'], [3, 1]).seek_shape(),
+                         self.seek(['age', 'id'], [2, 1]).seek_shape())
+
+
+class PaginateAfterTestCase(unittest.TestCase):
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            User.objects.all().paginate_after(size=0)
+        with self.assertRaises(TypeError):
+            User.objects.all()[:5].paginate_after()
+        with self.assertRaises(ValueError):
+            User.objects.all().paginate_after((1, 2, 3))
+
+
+class CursorTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        order = ['-date_added', 'name', 'id']
+        values = [datetime.datetime(2020, 1, 2, 3, 4, 5, 6), None, 7]
+        cursor = Page.encode_cursor(order, values)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(Page.decode_cursor(cursor, order), values)
+
+    def test_other_ordering(self):
+        cursor = Page.encode_cursor(['name', 'id'], ['a', 1])
+        with self.assertRaises(ValueError):
+            Page.decode_cursor(cursor, ['-name', 'id'])
+
+    def test_garbage(self):
+        for cursor in ('', 'not a cursor', Page.encode_cursor(['id'], [1])[:-3]):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                Page.decode_cursor(cursor, ['id'])
+
+    def test_page(self):
+        page = Page([1, 2], None)
+        self.assertFalse(page.has_next)
+        self.assertEqual((len(page), list(page)), (2, [1, 2]))
+        self.assertTrue(Page([], 'x').has_next)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+import os
+import socket
+import threading
+import unittest
+from unittest import mock
+import psycopg2
+from psycopg2 import extensions
+from exceptions import PoolError
+from pool import ConnectionPool, detach_inherited
+
+
+class FakeConnection:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.closed = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+        self.rollback_error = None
+        self.autocommit = False
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.rollback_error is not None:
+            raise self.rollback_error
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def connect(**kwargs):
+    kwargs.pop('connection_factory', None)
+    return FakeConnection(**kwargs)
+
+
+@mock.patch('pool.psycopg2.connect', side_effect=connect)
+class ConnectionPoolTestCase(unittest.TestCase):
+    def test_lazy_pool_connects_on_first_checkout(self, connect_mock):
+        pool = ConnectionPool(minconn=2, maxconn=4, lazy=True)
+        self.assertEqual(pool.size, 0)
+        with pool.connection():
+            self.assertEqual((pool.size, pool.used), (2, 1))
+        self.assertEqual((pool.size, pool.used), (2, 0))
+        self.assertEqual(connect_mock.call_count, 2)
+
+    def test_nested_checkouts_share_connection(self, connect_mock):
+        pool = ConnectionPool(minconn=0, maxconn=2)
+        with pool.connection() as outer:
+            with pool.connection() as inner:
+                self.assertIs(outer, inner)
+                self.assertIs(pool.current(), outer)
+            self.assertEqual(pool.used, 1)
+        self.assertIsNone(pool.current())
+        self.assertEqual((pool.size, pool.used), (1, 0))
+
+    def test_exhausted_pool_times_out(self, connect_mock):
+        pool = ConnectionPool(minconn=0, maxconn=1, timeout=0.05)
+        with pool.detached():
+            with self.assertRaises(PoolError):
+                with pool.detached():
+                    pass
+        self.assertEqual((pool.size, pool.used), (1, 0))
+
+    def test_waiting_thread_gets_released_connection(self, connect_mock):
+        pool = ConnectionPool(minconn=0, maxconn=1, timeout=5)
+        got = []
+        conn = pool.getconn()
+        thread = threading.Thread(target=lambda: got.append(pool._acquire()))
+        thread.start()
+        pool.putconn(conn)
+        thread.join(5)
+        self.assertEqual(got, [conn])
+        self.assertEqual((pool.size, pool.used), (1, 1))
+
+    def test_failed_connect_frees_slot(self, connect_mock):
+        pool = ConnectionPool(minconn=0, maxconn=1, timeout=0.05)
+        connect_mock.side_effect = psycopg2.OperationalError('refused')
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.getconn()
+        self.assertEqual((pool.size, pool.used, pool._pending), (0, 0, 0))
+
+        connect_mock.side_effect = connect
+        with pool.connection() as conn:
+            self.assertIsInstance(conn, FakeConnection)
+
+    def test_release_rolls_back_open_transaction(self, connect_mock):
+        pool = ConnectionPool(minconn=0, maxconn=1)
+        with pool.connection() as conn:
+            conn.status = extensions.TRANSACTION_STATUS_INTRANS
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertEqual((pool.size, conn.closed), (1, 0))
+
+    def test_connections_are_in_autocommit_mode(self, connect_mock):
+        pool = ConnectionPool(minconn=0, maxconn=1)
+        with pool.connection() as conn:
+            self.assertTrue(conn.autocommit)
+            conn.autocommit = False
+            conn.status = extensions.TRANSACTION_STATUS_INTRANS
+        self.assertEqual((conn.rollbacks, conn.autocommit), (1, True))
+
+        # reads in autocommit mode leave nothing to roll back
+        with pool.connection() as conn:
+            pass
+        self.assertEqual(conn.rollbacks, 1)
+
+    def test_broken_connection_is_discarded(self, connect_mock):
+        pool = ConnectionPool(minconn=0, maxconn=1)
+        with pool.connection() as conn:
+            conn.status = extensions.TRANSACTION_STATUS_INERROR
+            conn.rollback_error = psycopg2.InterfaceError('connection already closed')
+        self.assertEqual((pool.size, pool.used, conn.closed), (0, 0, 1))
+        with pool.connection() as other:
+            self.assertIsNot(other, conn)
+
+    def test_configure_replaces_connections(self, connect_mock):
+        pool = ConnectionPool(minconn=1, maxconn=2, host='a')
+        with pool.connection() as old:
+            pool.configure(host='b')
+        self.assertEqual((old.closed, pool.size), (1, 0))
+        with pool.connection() as new:
+            self.assertEqual(new.kwargs['host'], 'b')
+
+    def test_putconn_of_other_thread(self, connect_mock):
+        pool = ConnectionPool(minconn=0, maxconn=2)
+        conn = pool.getconn()
+        errors = []
+
+        def put():
+            try:
+                pool.putconn(conn)
+            except PoolError as e:
+                errors.append(e)
+        thread = threading.Thread(target=put)
+        thread.start()
+        thread.join(5)
+        self.assertEqual(len(errors), 1)
+        pool.putconn(conn)
+
+    def test_connects_run_in_parallel(self, connect_mock):
+        # both connects have to be in progress at once, so the pool lock isn't held while connecting
+        barrier = threading.Barrier(2, timeout=5)
+
+        def slow_connect(**kwargs):
+            barrier.wait()
+            return connect(**kwargs)
+        connect_mock.side_effect = slow_connect
+        pool = ConnectionPool(minconn=0, maxconn=2)
+        threads = [threading.Thread(target=lambda: pool.putconn(pool.getconn())) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertFalse(barrier.broken)
+        self.assertEqual((pool.size, pool.used), (2, 0))
+
+    def test_closed_pool(self, connect_mock):
+        pool = ConnectionPool(minconn=1, maxconn=1)
+        pool.closeall()
+        self.assertEqual(pool.size, 0)
+        with self.assertRaises(PoolError):
+            pool.getconn()
+
+
+class DetachInheritedTestCase(unittest.TestCase):
+    def test_writes_after_detach_dont_reach_peer(self):
+        child, parent = socket.socketpair()
+        self.addCleanup(child.close)
+        self.addCleanup(parent.close)
+        # parent process keeps its own descriptor of the socket
+        kept = os.dup(child.fileno())
+        self.addCleanup(os.close, kept)
+        conn = FakeConnection()
+        conn.fileno = child.fileno
+
+        detach_inherited([conn])
+        os.write(child.fileno(), b'X')
+        parent.setblocking(False)
+        with self.assertRaises(BlockingIOError):
+            parent.recv(1)
+
+    def test_closed_connection(self):
+        conn = FakeConnection()
+        conn.fileno = mock.Mock(side_effect=psycopg2.InterfaceError('connection already closed'))
+        detach_inherited([conn])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from psycopg2 import sql
+from model import QueryCache
+
+
+class Query:
+    """Stands for composed query, counts how many times it's rendered"""
+
+    def __init__(self, text):
+        self.text = text
+        self.rendered = 0
+
+    def as_string(self, context):
+        self.rendered += 1
+        return self.text
+
+
+class QueryCacheTestCase(unittest.TestCase):
+    def test_compose_only_on_miss(self):
+        cache = QueryCache()
+        query = Query('SELECT 1')
+        calls = []
+
+        def compose():
+            calls.append(1)
+            return query
+        self.assertEqual(cache.compile(('a',), compose, None), 'SELECT 1')
+        self.assertEqual(cache.compile(('a',), compose, None), 'SELECT 1')
+        self.assertEqual((len(calls), query.rendered), (1, 1))
+
+    def test_keys_by_shape(self):
+        cache = QueryCache()
+        self.assertEqual(cache.compile(('select', 1), lambda: Query('one'), None), 'one')
+        self.assertEqual(cache.compile(('select', 2), lambda: Query('two'), None), 'two')
+        self.assertEqual(cache.compile(('select', 1), lambda: Query('other'), None), 'one')
+
+    def test_least_recently_used_is_evicted(self):
+        cache = QueryCache(maxsize=2)
+        cache.compile('a', lambda: Query('a'), None)
+        cache.compile('b', lambda: Query('b'), None)
+        cache.compile('a', lambda: Query('new a'), None)
+        cache.compile('c', lambda: Query('c'), None)
+        self.assertEqual(cache.compile('a', lambda: Query('new a'), None), 'a')
+        self.assertEqual(cache.compile('b', lambda: Query('new b'), None), 'new b')
+
+    def test_clear(self):
+        cache = QueryCache()
+        cache.compile('a', lambda: Query('a'), None)
+        cache.clear()
+        self.assertEqual(cache.compile('a', lambda: Query('new a'), None), 'new a')
+
+    def test_values_are_placeholders(self):
+        # params never end up in cached SQL, so one entry serves every value
+        query = sql.SQL('SELECT * FROM t WHERE id = {}').format(sql.Placeholder())
+        self.assertEqual(QueryCache().compile('get', lambda: query, None), 'SELECT * FROM t WHERE id = %s')
+
+
+if __name__ == '__main__':
+    unittest.main()
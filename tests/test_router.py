@@ -0,0 +1,89 @@
+import unittest
+from unittest import mock
+from router import Router, _last_write
+
+
+class FakePool:
+    def __init__(self, name, used=0):
+        self.name = name
+        self.used = used
+        self.conn = None
+
+    def current(self):
+        return self.conn
+
+    def __repr__(self):
+        return self.name
+
+
+class FakeConnection:
+    def __init__(self, savepoints):
+        self.savepoints = savepoints
+
+
+class RouterTestCase(unittest.TestCase):
+    def setUp(self):
+        token = _last_write.set(None)
+        self.addCleanup(_last_write.reset, token)
+        self.primary = FakePool('primary')
+        self.replicas = [FakePool('r0', used=3), FakePool('r1', used=1), FakePool('r2', used=2)]
+
+    def test_without_replicas_everything_goes_to_primary(self):
+        router = Router(self.primary)
+        self.assertIs(router.db_for_read(), self.primary)
+        self.assertIs(router.db_for_read('replica'), self.primary)
+        self.assertIs(router.db_for_write(), self.primary)
+
+    def test_round_robin(self):
+        router = Router(self.primary, self.replicas)
+        self.assertEqual([router.db_for_read() for _ in range(4)], [*self.replicas, self.replicas[0]])
+
+    def test_least_load(self):
+        router = Router(self.primary, self.replicas, strategy='least_load')
+        self.assertIs(router.db_for_read(), self.replicas[1])
+        self.replicas[1].used = 5
+        self.assertIs(router.db_for_read(), self.replicas[2])
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            Router(self.primary, self.replicas, strategy='random')
+
+    def test_using(self):
+        router = Router(self.primary, {'east': self.replicas[0], 'west': self.replicas[1]})
+        self.assertIs(router.db_for_read('primary'), self.primary)
+        self.assertIs(router.db_for_read('west'), self.replicas[1])
+        self.assertIn(router.db_for_read('replica'), self.replicas[:2])
+        with self.assertRaises(ValueError):
+            router.db_for_read('north')
+
+    def test_default_replica_names(self):
+        router = Router(self.primary, self.replicas)
+        self.assertEqual(list(router.replicas), ['replica0', 'replica1', 'replica2'])
+
+    def test_atomic_block_pins_reads_to_primary(self):
+        router = Router(self.primary, self.replicas)
+        self.primary.conn = FakeConnection([None])
+        self.assertIs(router.db_for_read(), self.primary)
+        # explicit alias wins over pinning
+        self.assertIs(router.db_for_read('replica1'), self.replicas[1])
+        self.primary.conn = FakeConnection([])
+        self.assertIn(router.db_for_read(), self.replicas)
+
+    @mock.patch('router.time.monotonic')
+    def test_read_your_writes_window(self, monotonic):
+        router = Router(self.primary, self.replicas, read_your_writes=2.0)
+        monotonic.return_value = 100
+        router.record_write()
+        monotonic.return_value = 101.5
+        self.assertIs(router.db_for_read(), self.primary)
+        self.assertIn(router.db_for_read('replica'), self.replicas)
+        monotonic.return_value = 102.5
+        self.assertIn(router.db_for_read(), self.replicas)
+
+    def test_writes_without_replicas_are_not_recorded(self):
+        Router(self.primary).record_write()
+        self.assertIsNone(_last_write.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
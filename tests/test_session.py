@@ -0,0 +1,111 @@
+import contextlib
+import unittest
+from unittest import mock
+from model import Model
+from fields import StringField, IntField
+from session import UnitOfWork
+
+
+class Post(Model):
+    title = StringField()
+    views = IntField()
+
+    class Meta:
+        table_name = 'post'
+
+
+class Comment(Model):
+    text = StringField()
+
+    class Meta:
+        table_name = 'comment'
+
+
+def loaded(model_cls, **kwargs):
+    obj = model_cls(**kwargs)
+    obj.mark_saved()
+    return obj
+
+
+def set_ids(objs, batch_size=None):
+    for i, obj in enumerate(objs, 100):
+        object.__setattr__(obj, 'id', i)
+        obj.mark_saved()
+    return objs
+
+
+@mock.patch('session.atomic', contextlib.nullcontext)
+class UnitOfWorkFlushTestCase(unittest.TestCase):
+    def test_updates_grouped_by_model_and_fields(self):
+        first, second = loaded(Post, id=1, title='a', views=1), loaded(Post, id=2, title='b', views=2)
+        third, comment = loaded(Post, id=3, title='c', views=3), loaded(Comment, id=1, text='x')
+        first.title, second.title, third.views, comment.text = 'A', 'B', 30, 'X'
+
+        session = UnitOfWork()
+        for obj in (first, comment, third, second):
+            session.add(obj)
+        with mock.patch.object(Post.objects, '_update_objects') as update_posts, \
+                mock.patch.object(Comment.objects, '_update_objects') as update_comments:
+            session.flush()
+
+        self.assertEqual([(c.args[0], c.args[1]) for c in update_posts.call_args_list],
+                         [([first, second], ['title']), ([third], ['views'])])
+        update_comments.assert_called_once_with([comment], ['text'], batch_size=1000)
+        self.assertEqual(len(session), 0)
+        self.assertIsNone(first._changed)
+
+    def test_failed_flush_restores_state_and_keeps_queue(self):
+        new = Post(title='new', views=0)
+        dirty = loaded(Post, id=1, title='a', views=1)
+        dirty.title = 'b'
+        gone = loaded(Comment, id=2, text='x')
+
+        session = UnitOfWork()
+        session.add(new)
+        session.add(dirty)
+        session.delete(gone)
+        with mock.patch.object(Post.objects, 'bulk_create', side_effect=set_ids), \
+                mock.patch.object(Post.objects, '_update_objects', side_effect=RuntimeError('boom')), \
+                mock.patch.object(Comment.objects, '_delete_ids') as delete_ids:
+            with self.assertRaises(RuntimeError):
+                session.flush()
+
+        delete_ids.assert_not_called()
+        self.assertEqual(len(session), 3)
+        self.assertIsNone(new.id)
+        self.assertFalse(new._loaded)
+        self.assertTrue(dirty._loaded)
+        self.assertEqual(list(dirty._changed), ['title'])
+
+        with mock.patch.object(Post.objects, 'bulk_create', side_effect=set_ids) as bulk_create, \
+                mock.patch.object(Post.objects, '_update_objects') as update_objects, \
+                mock.patch.object(Comment.objects, '_delete_ids') as delete_ids:
+            session.flush()
+
+        bulk_create.assert_called_once_with([new], batch_size=1000)
+        update_objects.assert_called_once_with([dirty], ['title'], batch_size=1000)
+        delete_ids.assert_called_once_with([2])
+        self.assertEqual(new.id, 100)
+        self.assertEqual(len(session), 0)
+
+    def test_failed_insert_restores_ids(self):
+        first, second = Post(title='a', views=1), Post(title='b', views=2)
+
+        def fail(objs, batch_size=None):
+            set_ids(objs[:1])
+            raise RuntimeError('boom')
+
+        session = UnitOfWork()
+        session.add(first)
+        session.add(second)
+        with mock.patch.object(Post.objects, 'bulk_create', side_effect=fail):
+            with self.assertRaises(RuntimeError):
+                session.flush()
+
+        self.assertEqual([first.id, second.id], [None, None])
+        self.assertEqual([first._loaded, second._loaded], [False, False])
+        self.assertEqual(len(session), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
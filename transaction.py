@@ -0,0 +1,96 @@
+import functools
+from psycopg2 import sql
+from cache import invalidate_table
+
+
+def in_atomic(conn):
+    return bool(getattr(conn, 'savepoints', None))
+
+
+def commit(conn):
+    """Commit unless connection is inside atomic block, the block commits on exit"""
+    if not in_atomic(conn):
+        conn.commit()
+
+
+class Atomic:
+    """Context manager and decorator that runs ORM queries of the block in one transaction
+
+    Nested blocks use savepoints, so an exception rolls back only the innermost block.
+    Cached results of tables written in the block are invalidated after the commit."""
+
+    def __init__(self):
+        self._conns = []
+
+    @property
+    def pool(self):
+        # all ORM writes go through model's pool
+        from model import pool
+        return pool
+
+    def __enter__(self):
+        conn = self.pool.getconn()
+        if getattr(conn, 'savepoints', None) is None:
+            conn.savepoints = []
+        if getattr(conn, 'touched', None) is None:
+            conn.touched = set()
+
+        if conn.savepoints:
+            name = 'orm_sp_{}'.format(len(conn.savepoints))
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql.SQL('SAVEPOINT {}').format(sql.Identifier(name)).as_string(cursor))
+            except Exception:
+                self.pool.putconn(conn)
+                raise
+        else:
+            name = None
+            # pool connections are in autocommit mode, psycopg2 opens transaction before the block's first query
+            if conn.autocommit:
+                conn.autocommit = False
+
+        conn.savepoints.append(name)
+        self._conns.append(conn)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        conn = self._conns.pop()
+        name = conn.savepoints.pop()
+        try:
+            if name is None:
+                touched, conn.touched = conn.touched, set()
+                try:
+                    if exc_type is None:
+                        conn.commit()
+                    else:
+                        conn.rollback()
+                finally:
+                    if not conn.closed:
+                        conn.autocommit = True
+                    # rolled back block drops entries too, in case anything cached its uncommitted rows
+                    for table in touched:
+                        invalidate_table(table)
+            else:
+                with conn.cursor() as cursor:
+                    if exc_type is None:
+                        cursor.execute(sql.SQL('RELEASE SAVEPOINT {}').format(sql.Identifier(name)).as_string(cursor))
+                    else:
+                        cursor.execute(
+                            sql.SQL('ROLLBACK TO SAVEPOINT {}').format(sql.Identifier(name)).as_string(cursor))
+        finally:
+            self.pool.putconn(conn)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with Atomic():
+                return func(*args, **kwargs)
+        return inner
+
+
+def atomic(func=None):
+    """Use as @atomic, @atomic() or with atomic():"""
+    if callable(func):
+        return Atomic()(func)
+    return Atomic()